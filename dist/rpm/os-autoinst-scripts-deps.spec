@@ -26,7 +26,7 @@ BuildArch:      noarch
 Url:            https://github.com/os-autoinst/scripts
 Source0:        scripts-%{version}.tar.xz
 # The following line is generated from dependencies.yaml
-%define main_requires bash coreutils curl grep html-xml-utils jq openQA-client openssh-clients osc perl >= 5.010 perl(Data::Dumper) perl(FindBin) perl(Getopt::Long) perl(Mojo::File) perl(Text::Markdown) perl(YAML::PP) python3-beautifulsoup4 python3-requests retry sed sudo xmlstarlet yq
+%define main_requires bash coreutils curl grep html-xml-utils jq openQA-client openssh-clients osc perl >= 5.010 perl(Data::Dumper) perl(FindBin) perl(Getopt::Long) perl(Mojo::File) perl(Text::Markdown) perl(YAML::PP) python3-beautifulsoup4 python3-openqa_client python3-requests retry sed sudo xmlstarlet yq
 # The following line is generated from dependencies.yaml
 %define test_requires perl(Test::MockModule) perl(Test::Most) perl(Test::Output) perl(Test::Warnings) python3-pytest
 # The following line is generated from dependencies.yaml
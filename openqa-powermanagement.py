@@ -7,166 +7,541 @@
 import configparser
 import argparse
 import json
+import math
 import os
 import requests
+import shlex
 import subprocess
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
-machine_list_idle = []
-machine_list_offline = []
-machine_list_broken = []
-machine_list_busy = []
-machines_to_power_on = []
-
-jobs_worker_classes = []
+TIMEOUT = 60
+# Number of jobs fetched with one request via the jobs?ids= query
+BULK_SIZE = 100
+# Wait in seconds before retrying a failed power command, doubled on each retry
+RETRY_WAIT = 5
+# Number of the latest finished jobs the average runtime of a WORKER_CLASS is based on
+RUNTIME_JOBS = 20
 
 config_file = os.path.join(os.environ.get("OPENQA_CONFIG", "/etc/openqa"), "openqa.ini")
 config = configparser.ConfigParser()
-config.read(config_file)
 
 openqa_server = "http://localhost"
+# Shares keep-alive connections between the threads fetching jobs
+session = requests.Session()
 
-# Manage cmdline options
-if __name__ == "__main__":
+
+def non_negative_int(value):
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError("must not be negative: " + value)
+    return number
+
+
+def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--config")
     parser.add_argument("--dry-run", action="store_true")
     parser.add_argument("--host")
     parser.add_argument("--osd", action="store_true")
     parser.add_argument("--o3", action="store_true")
-    args = parser.parse_args()
-    if args.config is not None and len(args.config):
-        config_file = args.config
-    if args.host is not None and len(args.host):
-        openqa_server = args.host
-    elif args.osd:
-        openqa_server = "https://openqa.suse.de"
-    elif args.o3:
-        openqa_server = "https://openqa.opensuse.org"
+    parser.add_argument(
+        "--parallel", type=int, default=8, help="Number of concurrent requests"
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and check the scheduled jobs and workers every --interval seconds",
+    )
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=300,
+        help="Seconds between checks in daemon mode",
+    )
+    parser.add_argument(
+        "--min-idle",
+        type=int,
+        default=0,
+        help="Seconds a machine needs to be seen idle before powering it off in daemon mode",
+    )
+    parser.add_argument(
+        "--hold",
+        type=int,
+        default=600,
+        help="Seconds after powering a machine on or off before it is powered again in daemon mode, "
+        "e.g. to give it time to boot",
+    )
+    parser.add_argument(
+        "--power-parallel",
+        type=int,
+        default=8,
+        help="Number of power commands run at the same time",
+    )
+    parser.add_argument(
+        "--power-timeout",
+        type=int,
+        default=300,
+        help="Seconds after which a power command is stopped and considered failed",
+    )
+    parser.add_argument(
+        "--power-retries",
+        type=non_negative_int,
+        default=2,
+        help="Number of retries of a failed power command",
+    )
+    parser.add_argument(
+        "--drain-time",
+        type=int,
+        default=0,
+        help="Only power on as many machines as needed to run the scheduled jobs within this "
+        "many seconds and keep idle machines which can run them, 0 powers on every machine "
+        "able to run any of them",
+    )
+    parser.add_argument(
+        "--job-runtime",
+        type=int,
+        default=1800,
+        help="Runtime of a job in seconds used with --drain-time if there are no "
+        "finished jobs with its WORKER_CLASS to compute the average runtime from",
+    )
+    return parser.parse_args()
+
+
+class PowerState:
+    """Per machine state kept between the checks of the daemon mode."""
+
+    def __init__(self):
+        self.idle_since = {}
+        self.last_action = {}
+
+    def update_idle(self, machines, now):
+        self.idle_since = {
+            machine: self.idle_since.get(machine, now) for machine in machines
+        }
+
+    def held(self, machine, now):
+        return now - self.last_action.get(machine, -args.hold) < args.hold
+
 
-print("Using openQA server: " + openqa_server)
-print("Using config file: " + config_file)
-if args.dry_run:
-    print("Dry run mode")
-print("")
-
-# Scheduled/blocked jobs
-scheduled_list_file = requests.get(openqa_server + "/tests/list_scheduled_ajax").content
-scheduled_list_data = json.loads(scheduled_list_file)
-print(
-    "Processing "
-    + str(len(scheduled_list_data["data"]))
-    + " job(s) in scheduled/blocked state... (will take about "
-    + str(int(len(scheduled_list_data["data"]) * 0.2))
-    + " seconds)"
-)
-
-# Create list of WORKER_CLASS needed
-for job in scheduled_list_data["data"]:
-    response = requests.get(openqa_server + "/api/v1/jobs/" + str(job["id"]))
-    job_data = json.loads(response.content)
-    jobs_worker_classes.append(job_data["job"]["settings"]["WORKER_CLASS"])
-
-jobs_worker_classes = sorted(set(jobs_worker_classes))
-print(
-    "Found "
-    + str(len(jobs_worker_classes))
-    + " different WORKER_CLASS in scheduled jobs: "
-    + str(jobs_worker_classes)
-)
-
-
-# Workers
-workers_list_file = requests.get(openqa_server + "/api/v1/workers").content
-workers_list_data = json.loads(workers_list_file)
-
-# Create list of hosts which may need to powered up/down
-for worker in workers_list_data["workers"]:
-    if worker["status"] in ["idle"]:
-        machine_list_idle.append(worker["host"])
-    elif worker["status"] in ["dead"]:  # Looks like 'dead' means 'offline'
-        machine_list_offline.append(worker["host"])
-    elif worker["status"] in ["running"]:  # Looks like 'running' means 'working'
-        machine_list_busy.append(worker["host"])
-    elif worker["status"] in ["broken"]:
-        machine_list_broken.append(worker["host"])
+def fetch_job(job_id):
+    # Returns None for jobs which do not exist anymore
+    response = session.get(
+        openqa_server + "/api/v1/jobs/" + str(job_id), timeout=TIMEOUT
+    )
+    return response.json()["job"] if response.ok else None
+
+
+def fetch_worker_classes(ids):
+    # Use the bulk query and fall back to one request per job if the server
+    # ignores the ids parameter or does not support it
+    response = session.get(
+        openqa_server + "/api/v1/jobs",
+        params={"ids": ",".join(map(str, ids))},
+        timeout=TIMEOUT,
+    )
+    jobs = response.json().get("jobs") if response.ok else None
+    if jobs is not None and {job["id"] for job in jobs} <= set(ids):
+        # A server ignoring the ids parameter may return a subset of them by
+        # chance, so the result is only trusted if the missing jobs do not exist
+        missing = sorted(set(ids) - {job["id"] for job in jobs})
+        if any(fetch_job(job_id) is not None for job_id in missing):
+            jobs = None
     else:
-        print("Unhandle worker status: " + str(worker["status"]))
-
-# Clean-up the lists
-machine_list_idle = sorted(set(machine_list_idle))
-machine_list_offline = sorted(set(machine_list_offline))
-machine_list_broken = sorted(set(machine_list_broken))
-machine_list_busy = sorted(set(machine_list_busy))
-
-# Remove the machine from idle/offline lists if at least 1 worker is busy
-for machine in machine_list_busy:
-    if machine in machine_list_idle:
-        machine_list_idle.remove(machine)
-    if machine in machine_list_offline:
-        machine_list_offline.remove(machine)
-# Remove the machine from offline list if at least 1 worker is idle
-for machine in machine_list_idle:
-    if machine in machine_list_offline:
-        machine_list_offline.remove(machine)
-
-# Print an overview
-print(
-    str(len(machine_list_idle))
-    + " workers listed fully idle: "
-    + str(machine_list_idle)
-)
-print(
-    str(len(machine_list_offline))
-    + " workers listed offline/dead: "
-    + str(machine_list_offline)
-)
-print(
-    str(len(machine_list_broken))
-    + " workers listed broken: "
-    + str(machine_list_broken)
-)
-print(str(len(machine_list_busy)) + " workers listed busy: " + str(machine_list_busy))
-
-# Get WORKER_CLASS for each workers of each machines (idle and offline) and compare to WORKER_CLASS required by scheduled/blocked jobs
-for worker in workers_list_data["workers"]:
-    if worker["host"] in machine_list_offline:
-        for classes in jobs_worker_classes:
-            if set(classes.split(",")).issubset(
-                worker["properties"]["WORKER_CLASS"].split(",")
-            ):
-                machines_to_power_on.append(worker["host"])
-
-    if worker["host"] in machine_list_idle:
-        if worker["properties"]["WORKER_CLASS"] in jobs_worker_classes:
-            # Warning: scheduled (blocked?) job could be run on idle machine!
-            print("Warning: scheduled (blocked?) job could be run on idle machine!")
+        jobs = None
+    if jobs is None:
+        jobs = [fetch_job(job_id) for job_id in ids]
+    # Jobs which do not exist anymore are just missing in the result
+    return Counter(job["settings"]["WORKER_CLASS"] for job in jobs if job is not None)
+
+
+def get_jobs_worker_classes():
+    # Scheduled/blocked jobs
+    scheduled_list_file = session.get(
+        openqa_server + "/tests/list_scheduled_ajax", timeout=TIMEOUT
+    ).content
+    scheduled_list_data = json.loads(scheduled_list_file)
+    scheduled_ids = sorted({job["id"] for job in scheduled_list_data["data"]})
+    print(
+        "Processing "
+        + str(len(scheduled_ids))
+        + " job(s) in scheduled/blocked state..."
+    )
+
+    # Count the jobs needing each WORKER_CLASS
+    jobs_worker_classes = Counter()
+    chunks = [
+        scheduled_ids[i : i + BULK_SIZE]
+        for i in range(0, len(scheduled_ids), BULK_SIZE)
+    ]
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        for classes in executor.map(fetch_worker_classes, chunks):
+            jobs_worker_classes += classes
+    return jobs_worker_classes
+
+
+def class_index(workers, machines, statuses=None):
+    # Map each WORKER_CLASS to the workers of the given machines providing it
+    index = {}
+    for i, worker in enumerate(workers):
+        if worker["host"] in machines and (
+            statuses is None or worker["status"] in statuses
+        ):
+            for worker_class in worker["properties"]["WORKER_CLASS"].split(","):
+                index.setdefault(worker_class, set()).add(i)
+    return index
+
+
+def matching_workers(index, classes):
+    # A job can run on a worker providing all of the classes it requires
+    candidates = [index.get(c, set()) for c in set(classes.split(","))]
+    return set.intersection(*sorted(candidates, key=len))
+
+
+def matching_machines(workers, index, jobs_worker_classes):
+    matching = set()
+    for classes in jobs_worker_classes:
+        matching |= matching_workers(index, classes)
+    return {workers[i]["host"] for i in matching}
+
+
+def fetch_job_runtime(classes):
+    # Average runtime in seconds of the latest finished jobs with the given
+    # WORKER_CLASS or None if there are none
+    response = session.get(
+        openqa_server + "/api/v1/jobs",
+        params={"state": "done", "worker_class": classes, "limit": RUNTIME_JOBS},
+        timeout=TIMEOUT,
+    )
+    jobs = response.json().get("jobs") if response.ok else None
+    runtimes = [
+        (
+            datetime.fromisoformat(job["t_finished"])
+            - datetime.fromisoformat(job["t_started"])
+        ).total_seconds()
+        for job in jobs or []
+        # The server may ignore the filters
+        if job["settings"].get("WORKER_CLASS") == classes
+        and job.get("t_started")
+        and job.get("t_finished")
+    ][:RUNTIME_JOBS]
+    return sum(runtimes) / len(runtimes) if runtimes else None
+
+
+def get_job_runtimes(jobs_worker_classes):
+    classes = sorted(jobs_worker_classes)
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        runtimes = dict(zip(classes, executor.map(fetch_job_runtime, classes)))
+    for worker_class, runtime in runtimes.items():
+        if runtime is None:
+            print(
+                "No finished jobs with WORKER_CLASS "
+                + worker_class
+                + ", assuming a runtime of "
+                + str(args.job_runtime)
+                + " seconds"
+            )
+        else:
+            print(
+                "Average runtime of jobs with WORKER_CLASS "
+                + worker_class
+                + ": "
+                + str(int(runtime))
+                + " seconds"
+            )
+    return {c: runtime for c, runtime in runtimes.items() if runtime is not None}
+
+
+def plan_power_on(
+    workers, jobs_worker_classes, machines_offline, machines_online, runtimes=None
+):
+    # Pick as few offline machines as needed to run the scheduled jobs within
+    # --drain-time, counting the workers which are already online
+    runtimes = runtimes or {}
+    offline = class_index(workers, machines_offline)
+    online = class_index(workers, machines_online, ("idle", "running"))
+    planned = set()
+    # Classes with the most jobs first as their machines may also serve other classes
+    for classes, count in sorted(
+        jobs_worker_classes.items(), key=lambda c: (-c[1], c[0])
+    ):
+        runtime = runtimes.get(classes, args.job_runtime)
+        needed = math.ceil(count * runtime / args.drain_time)
+        needed -= len(matching_workers(online, classes))
+        slots = Counter(workers[i]["host"] for i in matching_workers(offline, classes))
+        needed -= sum(slots[machine] for machine in planned & slots.keys())
+        for machine in sorted(slots.keys() - planned, key=lambda m: (-slots[m], m)):
+            if needed <= 0:
+                break
+            print(
+                "Planning to power ON '"
+                + machine
+                + "' for "
+                + str(count)
+                + " job(s) with WORKER_CLASS "
+                + classes
+            )
+            planned.add(machine)
+            needed -= slots[machine]
+        if needed > 0:
+            print(
+                "Missing "
+                + str(needed)
+                + " worker(s) to run "
+                + str(count)
+                + " job(s) with WORKER_CLASS "
+                + classes
+                + " within "
+                + str(args.drain_time)
+                + " seconds"
+            )
+    return planned
 
-# Power on machines which can run scheduled jobs
-for machine in sorted(set(machines_to_power_on)):
-    if machine in machine_list_broken:
+
+def power_command(machine, action, state, now):
+    # Returns the command to power the machine on or off, if it should be run
+    if state.held(machine, now):
         print(
-            "Removing '"
+            "Not powering "
+            + action
+            + " '"
             + machine
-            + "' from the list to power ON since some workers are broken there"
+            + "' since it was powered on or off less than "
+            + str(args.hold)
+            + " seconds ago"
         )
     elif args.dry_run:
-        print("Would power ON '" + machine + "' - Dry run mode")
+        print("Would power " + action + " '" + machine + "' - Dry run mode")
+        state.last_action[machine] = now
     elif "power_management" in config and config["power_management"].get(
-        machine + "_POWER_ON"
+        machine + "_POWER_" + action
     ):
-        print("Powering ON: " + machine)
-        subprocess.call(config["power_management"][machine + "_POWER_ON"])
+        return config["power_management"][machine + "_POWER_" + action]
     else:
-        print("Unable to power ON '" + machine + "' - No command for that")
+        print("Unable to power " + action + " '" + machine + "' - No command for that")
+    return None
 
-# Power off machines which are idle or broken (TODO: add a threshold, e.g. idle since more than 15 minutes. Does API provide this information?)
-for machine in machine_list_idle + machine_list_broken:
-    if args.dry_run:
-        print("Would power OFF '" + machine + "' - Dry run mode")
-    elif "power_management" in config and config["power_management"].get(
-        machine + "_POWER_OFF"
-    ):
-        print("Powering OFF: " + machine)
-        subprocess.call(config["power_management"][machine + "_POWER_OFF"])
+
+def run_power_command(command):
+    # Returns the error of the last attempt, if all failed, and the number of attempts
+    attempts = max(args.power_retries, 0) + 1
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(RETRY_WAIT * 2 ** (attempt - 1))
+        try:
+            result = subprocess.run(
+                shlex.split(command), timeout=args.power_timeout, check=False
+            )
+        except subprocess.TimeoutExpired:
+            error = "timed out after " + str(args.power_timeout) + " seconds"
+        except OSError as e:
+            error = str(e)
+        else:
+            if result.returncode == 0:
+                return None, attempt + 1
+            error = "exit code " + str(result.returncode)
+    return error, attempts
+
+
+def power(actions, state, now):
+    commands = []
+    for machine, action in actions:
+        command = power_command(machine, action, state, now)
+        if command is not None:
+            print("Powering " + action + ": " + machine)
+            commands.append((machine, action, command))
+
+    def run(command):
+        start = time.monotonic()
+        error, attempts = run_power_command(command)
+        return error, attempts, time.monotonic() - start
+
+    # Run the commands concurrently so slow or hanging BMCs do not hold up the others
+    with ThreadPoolExecutor(max_workers=args.power_parallel) as executor:
+        results = executor.map(run, [command for _, _, command in commands])
+        for (machine, action, _), (error, attempts, duration) in zip(commands, results):
+            if error is None:
+                state.last_action[machine] = now
+                print(
+                    "Powered "
+                    + action
+                    + " '"
+                    + machine
+                    + "' in "
+                    + str(round(duration, 1))
+                    + " seconds"
+                )
+            else:
+                print(
+                    "Unable to power "
+                    + action
+                    + " '"
+                    + machine
+                    + "' after "
+                    + str(attempts)
+                    + " attempt(s) in "
+                    + str(round(duration, 1))
+                    + " seconds: "
+                    + error
+                )
+
+
+def check(state):
+    now = time.monotonic()
+    jobs_worker_classes = get_jobs_worker_classes()
+    print(
+        "Found "
+        + str(len(jobs_worker_classes))
+        + " different WORKER_CLASS in scheduled jobs: "
+        + str(sorted(jobs_worker_classes))
+    )
+
+    # Workers
+    workers_list_file = session.get(
+        openqa_server + "/api/v1/workers", timeout=TIMEOUT
+    ).content
+    workers = json.loads(workers_list_file)["workers"]
+
+    # Create sets of hosts which may need to powered up/down
+    machines_idle = set()
+    machines_offline = set()
+    machines_broken = set()
+    machines_busy = set()
+    for worker in workers:
+        if worker["status"] in ["idle"]:
+            machines_idle.add(worker["host"])
+        elif worker["status"] in ["dead"]:  # Looks like 'dead' means 'offline'
+            machines_offline.add(worker["host"])
+        elif worker["status"] in ["running"]:  # Looks like 'running' means 'working'
+            machines_busy.add(worker["host"])
+        elif worker["status"] in ["broken"]:
+            machines_broken.add(worker["host"])
+        else:
+            print("Unhandle worker status: " + str(worker["status"]))
+
+    # Remove the machine from idle/offline lists if at least 1 worker is busy
+    machines_idle -= machines_busy
+    # Remove the machine from offline list if at least 1 worker is idle
+    machines_offline -= machines_busy | machines_idle
+
+    machine_list_idle = sorted(machines_idle)
+    machine_list_offline = sorted(machines_offline)
+    machine_list_broken = sorted(machines_broken)
+    machine_list_busy = sorted(machines_busy)
+
+    # Print an overview
+    print(
+        str(len(machine_list_idle))
+        + " workers listed fully idle: "
+        + str(machine_list_idle)
+    )
+    print(
+        str(len(machine_list_offline))
+        + " workers listed offline/dead: "
+        + str(machine_list_offline)
+    )
+    print(
+        str(len(machine_list_broken))
+        + " workers listed broken: "
+        + str(machine_list_broken)
+    )
+    print(
+        str(len(machine_list_busy)) + " workers listed busy: " + str(machine_list_busy)
+    )
+
+    # Compare WORKER_CLASS of the workers of offline machines to WORKER_CLASS required by scheduled/blocked jobs
+    if args.drain_time:
+        machines_to_power_on = plan_power_on(
+            workers,
+            jobs_worker_classes,
+            machines_offline - machines_broken,
+            machines_idle | machines_busy,
+            get_job_runtimes(jobs_worker_classes),
+        )
+        # Keep idle machines which can run scheduled jobs
+        index = class_index(workers, machines_idle)
+        machines_needed = matching_machines(workers, index, jobs_worker_classes)
     else:
-        print("Unable to power OFF '" + machine + "' - No command for that")
+        index = class_index(workers, machines_offline)
+        machines_to_power_on = matching_machines(workers, index, jobs_worker_classes)
+        machines_needed = set()
+    for worker in workers:
+        if (
+            worker["host"] in machines_idle
+            and worker["properties"]["WORKER_CLASS"] in jobs_worker_classes
+        ):
+            # Warning: scheduled (blocked?) job could be run on idle machine!
+            print("Warning: scheduled (blocked?) job could be run on idle machine!")
+
+    # Power on machines which can run scheduled jobs
+    actions = []
+    for machine in sorted(machines_to_power_on):
+        if machine in machines_broken:
+            print(
+                "Removing '"
+                + machine
+                + "' from the list to power ON since some workers are broken there"
+            )
+        else:
+            actions.append((machine, "ON"))
+
+    # Power off machines which are idle or broken
+    state.update_idle(machines_idle, now)
+    for machine in sorted(machines_idle | machines_broken):
+        idle = now - state.idle_since.get(machine, now)
+        if machine in machines_needed:
+            print("Not powering OFF '" + machine + "' since it can run scheduled jobs")
+        elif args.daemon and machine in machines_idle and idle < args.min_idle:
+            print(
+                "Not powering OFF '"
+                + machine
+                + "' since it is idle for only "
+                + str(int(idle))
+                + " seconds"
+            )
+        else:
+            actions.append((machine, "OFF"))
+    power(actions, state, now)
+
+
+def main():
+    state = PowerState()
+    if not args.daemon:
+        check(state)
+        return
+    while True:
+        try:
+            check(state)
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            print("Unable to check scheduled jobs and workers: " + str(e))
+        print()
+        time.sleep(args.interval)
+
+
+# Manage cmdline options
+if __name__ == "__main__":
+    args = parse_args()
+    if args.config is not None and len(args.config):
+        config_file = args.config
+    if args.host is not None and len(args.host):
+        openqa_server = args.host
+    elif args.osd:
+        openqa_server = "https://openqa.suse.de"
+    elif args.o3:
+        openqa_server = "https://openqa.opensuse.org"
+    config.read(config_file)
+
+    print("Using openQA server: " + openqa_server)
+    print("Using config file: " + config_file)
+    if args.dry_run:
+        print("Dry run mode")
+    print("")
+
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=args.parallel, pool_maxsize=args.parallel
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    main()
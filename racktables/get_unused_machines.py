@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 from racktables import Racktables, RacktablesObject
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getpass
 import os
 
 rt_url = os.environ.get("RT_URL", "https://racktables.suse.de")
+parallel = int(os.environ.get("RT_PARALLEL", "8"))
 user = (
     os.environ["RT_USERNAME"]
     if "RT_USERNAME" in os.environ.keys()
@@ -15,7 +17,7 @@ pwd = (
     else getpass("Password (masked): ")
 )
 
-rt = Racktables(rt_url, user, pwd)
+rt = Racktables(rt_url, user, pwd, pool_size=parallel)
 search_payload = {
     "andor": "and",
     "cft[]": "197",
@@ -26,11 +28,19 @@ search_payload = {
     "submit.y": "24",
 }
 results = rt.search(search_payload)
-for result_obj in results:
+
+
+def fetch_object(result_obj):
     url_path = result_obj.find("a")["href"]
     obj = RacktablesObject(rt)
     obj.from_path(url_path)
-    try:
-        print(obj.fqdn, flush=True)
-    except Exception:
-        print(obj.common_name, flush=True)
+    return obj
+
+
+# fetch the objects concurrently, results are printed in the order of the search
+with ThreadPoolExecutor(max_workers=parallel) as executor:
+    for obj in executor.map(fetch_object, results):
+        try:
+            print(obj.fqdn, flush=True)
+        except Exception:
+            print(obj.common_name, flush=True)
@@ -1,14 +1,56 @@
 #!/usr/bin/env python3
 from requests.auth import HTTPBasicAuth
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from os.path import join as join
 import requests
 import re
 
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+# lxml is much faster than the parser of the standard library
+PARSER = "lxml" if lxml else "html.parser"
+# xpath for the class attribute containing a given class
+HAS_CLASS = 'contains(concat(" ", normalize-space(@class), " "), " %s ")'
+
+
+def summary_rows(html):
+    """Return the name and value of each row of the summary portlet of an object page."""
+    if lxml:
+        # only look at the summary rows instead of building a tree of the whole page
+        doc = lxml.html.fromstring(html)
+        objectview = doc.xpath("//table[%s]" % (HAS_CLASS % "objectview"))[0]
+        portlets = objectview.xpath(".//div[%s]" % (HAS_CLASS % "portlet"))
+        summary = next(
+            x for x in portlets if x.find(".//h2").text_content() == "summary"
+        )
+        rows = [(row.find(".//th"), row.find(".//td")) for row in summary.iter("tr")]
+        return [
+            (th.text_content(), td.text_content())
+            for th, td in rows
+            if th is not None and td is not None
+        ]
+    soup = BeautifulSoup(
+        html, PARSER, parse_only=SoupStrainer("table", {"class": "objectview"})
+    )
+    objectview_table = soup.find("table", {"class": "objectview"})
+    portlets = list(objectview_table.find_all("div", {"class": "portlet"}))
+    summary = next(x for x in portlets if x.find("h2").text == "summary")
+    rows = [(row.find("th"), row.find("td")) for row in summary.find_all("tr")]
+    return [(th.text, td.text) for th, td in rows if th is not None and td is not None]
+
 
 class Racktables:
-    def __init__(self, url, username, password):
+    def __init__(self, url, username, password, pool_size=10):
         self.s = requests.Session()
+        # keep enough connections for threads sharing the session
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        self.s.mount("http://", adapter)
+        self.s.mount("https://", adapter)
         self.s.verify = "/etc/ssl/certs/SUSE_Trust_Root.pem"
         self.s.auth = HTTPBasicAuth(username, password)
         self.url = url
@@ -25,7 +67,9 @@ class Racktables:
             raise Exception(
                 f"Racktables returned statuscode {status} while trying to access {req.request.url}. Manual investigation needed."
             )
-        soup = BeautifulSoup(req.text, "html.parser")
+        soup = BeautifulSoup(
+            req.text, PARSER, parse_only=SoupStrainer("table", {"class": "cooltable"})
+        )
         result_table = soup.find("table", {"class": "cooltable"})
         result_objs = result_table.find_all(
             "tr", lambda tag: tag is not None
@@ -39,15 +83,8 @@ class RacktablesObject:
 
     def from_path(self, url_path):
         req = self.rt_obj.s.get(join(self.rt_obj.url, url_path))
-        soup = BeautifulSoup(req.text, "html.parser")
-        objectview_table = soup.find("table", {"class": "objectview"})
-        portlets = list(objectview_table.find_all("div", {"class": "portlet"}))
-        summary = list(filter(lambda x: x.find("h2").text == "summary", portlets))[0]
-        rows = list(summary.find_all("tr"))
-        for row in rows:
+        for name, value in summary_rows(req.text):
             try:
-                name = row.find("th").text
-                value = row.find("td").text
                 sane_name = re.sub(r"[^a-z_]+", "", name.lower().replace(" ", "_"))
                 setattr(self, sane_name, value)
             except Exception:
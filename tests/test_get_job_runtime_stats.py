@@ -0,0 +1,243 @@
+"""
+tests for openqa-get-job-runtime-stats
+"""
+
+import importlib.machinery
+import importlib.util
+import json
+import os.path
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+rootpath = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+loader = importlib.machinery.SourceFileLoader(
+    "runtime_stats", rootpath + "/openqa-get-job-runtime-stats"
+)
+spec = importlib.util.spec_from_loader(loader.name, loader)
+runtime_stats = importlib.util.module_from_spec(spec)
+loader.exec_module(runtime_stats)
+
+START = datetime(2023, 1, 25, 10, 22, 21)
+
+
+def job(job_id, test, runtime=None, result="passed", state="done", machine="64bit"):
+    finished = None
+    if runtime is not None:
+        finished = (START + timedelta(seconds=runtime)).isoformat()
+    return {
+        "id": job_id,
+        "test": test,
+        "state": state,
+        "result": result,
+        "t_started": START.isoformat() if runtime is not None else None,
+        "t_finished": finished,
+        "settings": {"MACHINE": machine, "FLAVOR": "DVD"},
+    }
+
+
+JOBS = [
+    job(1, "boot", 100),
+    job(2, "boot", 120),
+    job(3, "single", 50),
+    job(4, "boot", 90, result="softfailed"),
+    job(5, "boot", 1000, result="failed"),
+    job(6, "failing", 10, result="failed"),
+    job(7, "incomplete", state="running", result="none"),
+    job(8, "boot", 4000),
+    job(9, "boot", 110, machine="uefi"),
+    job(10, "even", 10),
+    job(11, "even", 20),
+    job(12, "even", 40),
+    job(13, "even", 70),
+]
+
+
+def reference(jobs, keys=()):
+    # straightforward statistics of each group in the order of first appearance
+    groups = {}
+    for j in jobs:
+        label = (j["test"],) + tuple(j["settings"][k] for k in keys)
+        groups.setdefault(label, []).append(j)
+    result = {}
+    for label, group in groups.items():
+        ok = [
+            j
+            for j in group
+            if j["state"] == "done" and j["result"] in ("passed", "softfailed")
+        ]
+        runtimes = np.array(
+            [
+                (
+                    datetime.fromisoformat(j["t_finished"])
+                    - datetime.fromisoformat(j["t_started"])
+                ).total_seconds()
+                for j in ok
+            ]
+        )
+        stats = {
+            "runs": len(group),
+            "done": sum(j["state"] == "done" for j in group),
+            "ok": len(ok),
+        }
+        if len(ok) > 0:
+            stats.update(
+                mean=runtimes.mean(),
+                stdev=runtimes.std(),
+                median=np.median(runtimes),
+                min=runtimes.min(),
+                max=runtimes.max(),
+                p90=np.percentile(runtimes, 90),
+                p99=np.percentile(runtimes, 99),
+                mad=np.median(np.abs(runtimes - np.median(runtimes))),
+            )
+        result[label] = stats
+    return result
+
+
+@pytest.mark.parametrize("keys", [(), ("MACHINE",)])
+def test_group_stats_match_reference(keys):
+    table = runtime_stats.JobTable([runtime_stats.slim_job(j) for j in JOBS])
+    groups, stats, _ = runtime_stats.group_stats(table, keys)
+    expected = reference(JOBS, keys)
+    assert groups == list(expected)
+    for g, label in enumerate(groups):
+        for name, value in expected[label].items():
+            assert stats[name][g] == pytest.approx(value), (label, name)
+        if expected[label]["ok"] == 0:
+            # no runtime statistics for groups without passing jobs
+            assert np.isnan(stats["mean"][g])
+            assert np.isnan(stats["median"][g])
+
+
+def test_single_element_group():
+    table = runtime_stats.JobTable([runtime_stats.slim_job(j) for j in JOBS])
+    groups, stats, outliers = runtime_stats.group_stats(table)
+    g = groups.index(("single",))
+    for name in ("min", "max", "median", "mean", "p90", "p99"):
+        assert stats[name][g] == 50
+    assert stats["stdev"][g] == 0
+    assert stats["mad"][g] == 0
+    assert outliers[g] == []
+
+
+def test_grouped_percentiles_empty_groups():
+    codes = np.array([0, 0, 2], dtype=np.int64)
+    values = np.array([3.0, 1.0, 5.0])
+    result = runtime_stats.grouped_percentiles(codes, values, 4, [0, 0.5, 1])
+    assert result[:, 0].tolist() == [1, 2, 3]
+    assert np.isnan(result[:, 1]).all()
+    assert result[:, 2].tolist() == [5, 5, 5]
+    assert np.isnan(result[:, 3]).all()
+    assert runtime_stats.grouped_percentiles(codes[:0], values[:0], 0, [0.5]).shape == (
+        1,
+        0,
+    )
+
+
+def test_outliers():
+    table = runtime_stats.JobTable([runtime_stats.slim_job(j) for j in JOBS])
+    groups, _, outliers = runtime_stats.group_stats(table)
+    assert outliers[groups.index(("boot",))] == [(8, 4000.0)]
+    assert outliers[groups.index(("even",))] == []
+
+
+def test_outliers_zero_mad():
+    # more than half of the runtimes are equal, so the MAD is 0
+    jobs = [job(i, "same", 100) for i in range(5)]
+    jobs += [job(5, "same", 101), job(6, "same", 500)]
+    table = runtime_stats.JobTable([runtime_stats.slim_job(j) for j in jobs])
+    _, stats, outliers = runtime_stats.group_stats(table)
+    assert stats["mad"][0] == 0
+    # a tiny deviation is no outlier, the big one is
+    assert outliers[0] == [(6, 500.0)]
+    # no outliers if all runtimes are equal
+    table = runtime_stats.JobTable([runtime_stats.slim_job(j) for j in jobs[:5]])
+    _, _, outliers = runtime_stats.group_stats(table)
+    assert outliers[0] == []
+
+
+class FakeServer:
+    # Answers requests like the openQA API, optionally ignoring the ids parameter
+    def __init__(self, job_ids, bulk=True, default=()):
+        self.jobs = {i: job(i, "test", 60) for i in job_ids}
+        self.bulk = bulk
+        self.default = default
+        self.requests = []
+
+    def get(self, url, params=None, timeout=None):
+        self.requests.append((url, params))
+        path = url.split("/api/v1/")[1]
+        response = MagicMock(ok=True, status_code=200)
+        if path == "jobs":
+            ids = self.default
+            if self.bulk:
+                ids = [int(i) for i in params["ids"].split(",")]
+            data = {"jobs": [self.jobs[i] for i in ids if i in self.jobs]}
+        elif int(path.split("/")[1]) in self.jobs:
+            data = {"job": self.jobs[int(path.split("/")[1])]}
+        else:
+            response.ok, response.status_code, data = False, 404, {"error": "not found"}
+        response.json.return_value = data
+        return response
+
+
+def fetch(server, ids):
+    fetcher = runtime_stats.JobFetcher(1)
+    fetcher.session = server
+    return [j["id"] for j in fetcher.fetch("http://openqa", ids)], fetcher
+
+
+def test_fetch_bulk():
+    server = FakeServer(range(1, 10))
+    ids, fetcher = fetch(server, [3, 1, 2])
+    assert ids == [3, 1, 2]
+    assert len(server.requests) == 1
+    assert fetcher.bulk["http://openqa"]
+
+
+def test_fetch_bulk_missing_jobs():
+    # jobs which do not exist are checked and skipped
+    server = FakeServer([1, 3])
+    ids, fetcher = fetch(server, [1, 2, 3])
+    assert ids == [1, 3]
+    assert server.requests[1][0] == "http://openqa/api/v1/jobs/2"
+    assert fetcher.bulk["http://openqa"]
+
+
+@pytest.mark.parametrize("default", [(1, 2), (1, 2, 3, 4, 5), ()])
+def test_fetch_bulk_ignored(default):
+    # a host ignoring the ids parameter returns a subset, a superset or nothing
+    server = FakeServer([1, 2, 3, 4, 5], bulk=False, default=default)
+    ids, fetcher = fetch(server, [1, 2, 3])
+    assert ids == [1, 2, 3]
+    assert not fetcher.bulk["http://openqa"]
+
+
+def test_job_cache(tmp_path):
+    cache = runtime_stats.JobCache(str(tmp_path / "cache" / "jobs.db"), 10**6)
+    jobs = [job(1, "test", 60), job(2, "test", state="running"), job(3, "test", 60)]
+    cache.put("http://openqa", jobs)
+    # only finished jobs are cached, per host
+    assert sorted(cache.get("http://openqa", [1, 2, 3])) == [1, 3]
+    assert cache.get("http://openqa", [1])[1] == jobs[0]
+    assert cache.get("http://other", [1, 2, 3]) == {}
+    assert cache.get("http://openqa", []) == {}
+
+
+def test_job_cache_evict(tmp_path):
+    size = len(json.dumps(job(1, "test", 60)))
+    cache = runtime_stats.JobCache(str(tmp_path / "jobs.db"), 2 * size)
+    with patch("time.time", return_value=1):
+        cache.put("http://openqa", [job(1, "test", 60), job(2, "test", 60)])
+    with patch("time.time", return_value=2):
+        cache.put("http://openqa", [job(3, "test", 60)])
+    with patch("time.time", return_value=3):
+        cache.get("http://openqa", [1])
+    cache.evict()
+    # the least recently used job is evicted
+    assert sorted(cache.get("http://openqa", [1, 2, 3])) == [1, 3]
@@ -28,32 +28,50 @@ loader.exec_module(bats_review)
 #
 
 
-class TestGetFile:
+class TestGetFileChunks:
     @patch("bats_review.session")
-    def test_get_file_success(self, mock_session):
+    def test_get_file_chunks_success(self, mock_session):
         resp = Mock()
-        resp.text = "hello"
+        resp.iter_content.return_value = iter([b"hel", b"lo"])
         resp.raise_for_status = Mock()
         mock_session.get.return_value = resp
 
-        got = bats_review.get_file("http://example.com/foo.xml")
-        assert got == "hello"
+        got = b"".join(bats_review.get_file_chunks("http://example.com/foo.xml"))
+        assert got == b"hello"
         mock_session.get.assert_called_once_with(
             "http://example.com/foo.xml",
             headers={"User-Agent": bats_review.USER_AGENT},
             timeout=bats_review.TIMEOUT,
+            stream=True,
         )
         resp.raise_for_status.assert_called_once()
+        resp.close.assert_called_once()
 
     @patch("bats_review.session")
     @patch("bats_review.log")
-    def test_get_file_request_exception(self, mock_log, mock_session):
+    def test_get_file_chunks_request_exception(self, mock_log, mock_session):
         mock_session.get.side_effect = RequestException("network")
         with pytest.raises(SystemExit) as exc:
-            bats_review.get_file("http://example.com/foo.xml")
+            list(bats_review.get_file_chunks("http://example.com/foo.xml"))
         assert exc.value.code == 1
         mock_log.error.assert_called_once()
 
+    @patch("bats_review.session")
+    @patch("bats_review.log")
+    def test_get_file_chunks_interrupted(self, mock_log, mock_session):
+        def chunks(chunk_size):
+            yield b"<testsuite>"
+            raise RequestException("connection reset")
+
+        resp = Mock()
+        resp.iter_content.side_effect = chunks
+        mock_session.get.return_value = resp
+        with pytest.raises(SystemExit) as exc:
+            list(bats_review.get_file_chunks("http://example.com/foo.xml"))
+        assert exc.value.code == 1
+        mock_log.error.assert_called_once()
+        resp.close.assert_called_once()
+
 
 class TestGetJob:
     def setup_method(self):
@@ -88,11 +106,96 @@ class TestGetJob:
         mock_log.error.assert_called_once()
 
 
+class TestCache:
+    def setup_method(self):
+        bats_review.get_job.cache_clear()
+
+    def test_cache_file(self, tmp_path):
+        assert bats_review.cache_file("http://openqa/api/v1/jobs/1/details") is None
+        with patch.object(bats_review, "cache_dir", str(tmp_path)):
+            assert bats_review.cache_file(
+                "http://openqa/api/v1/jobs/123/details"
+            ) == str(tmp_path / "openqa" / "123" / "details.json")
+            assert bats_review.cache_file(
+                "https://openqa:8080/tests/123/file/podman.xml"
+            ) == str(tmp_path / "openqa:8080" / "123" / "podman.xml.json")
+
+    def test_prune_cache(self, tmp_path):
+        old, new = tmp_path / "openqa" / "1", tmp_path / "openqa" / "2"
+        for path in (old, new):
+            bats_review.write_cache(str(path / "details.json"), {})
+        os.utime(old, (0, 0))
+        (tmp_path / "file").write_text("")
+        with patch.object(bats_review, "cache_dir", str(tmp_path)):
+            bats_review.prune_cache(30)
+        assert not old.exists()
+        assert new.exists()
+
+    def test_read_cache_invalid(self, tmp_path):
+        path = tmp_path / "broken.json"
+        path.write_text("{")
+        assert bats_review.read_cache(str(path)) is None
+        assert bats_review.read_cache(str(tmp_path / "missing.json")) is None
+
+    @patch("bats_review.session")
+    def test_get_job_cached_when_done(self, mock_session, tmp_path):
+        resp = Mock()
+        resp.json.return_value = {
+            "job": {
+                "id": 1,
+                "state": "done",
+                "ulogs": ["a.xml"],
+                "settings": {"TEST": "podman_testsuite", "DISTRI": "sle", "X": "1"},
+                "testresults": [{"name": "module"}],
+            }
+        }
+        mock_session.get.return_value = resp
+        url = "http://openqa/api/v1/jobs/1/details"
+        with patch.object(bats_review, "cache_dir", str(tmp_path)):
+            job = bats_review.get_job(url)
+            # Only the fields used by the script are kept
+            assert job == {
+                "id": 1,
+                "state": "done",
+                "ulogs": ["a.xml"],
+                "settings": {"TEST": "podman_testsuite", "DISTRI": "sle"},
+            }
+            bats_review.get_job.cache_clear()
+            assert bats_review.get_job(url) == job
+        mock_session.get.assert_called_once()
+        assert (tmp_path / "openqa" / "1" / "details.json").exists()
+
+    @patch("bats_review.session")
+    def test_get_job_not_cached_when_running(self, mock_session, tmp_path):
+        resp = Mock()
+        resp.json.return_value = {"job": {"id": 1, "state": "running"}}
+        mock_session.get.return_value = resp
+        with patch.object(bats_review, "cache_dir", str(tmp_path)):
+            bats_review.get_job("http://openqa/api/v1/jobs/1/details")
+        assert not list(tmp_path.iterdir())
+
+    @patch("bats_review.get_file_chunks")
+    def test_grep_failures_cached(self, mock_get_file_chunks, tmp_path):
+        xml = b'<testsuite><testcase classname="c" name="n"><failure/></testcase></testsuite>'
+        mock_get_file_chunks.side_effect = lambda url: iter([xml])
+        url = "http://openqa/tests/1/file/test.xml"
+        with patch.object(bats_review, "cache_dir", str(tmp_path)):
+            # Not cached while the details of the job aren't
+            assert bats_review.grep_failures(url) == {"c:n"}
+            assert mock_get_file_chunks.call_count == 1
+            assert not (tmp_path / "openqa" / "1" / "test.xml.json").exists()
+
+            bats_review.write_cache(str(tmp_path / "openqa" / "1" / "details.json"), {})
+            assert bats_review.grep_failures(url) == {"c:n"}
+            assert bats_review.grep_failures(url) == {"c:n"}
+        assert mock_get_file_chunks.call_count == 2
+
+
 class TestGrepFailures:
-    @patch("bats_review.get_file")
-    def test_grep_failures_success(self, mock_get_file):
+    @patch("bats_review.get_file_chunks")
+    def test_grep_failures_success(self, mock_get_file_chunks):
         # one passing, one failing testcase (with classname)
-        xml = """
+        xml = b"""
         <testsuite>
           <testcase classname="suite1" name="ok"/>
           <testcase classname="suite1" name="failing_test">
@@ -100,20 +203,56 @@ class TestGrepFailures:
           </testcase>
         </testsuite>
         """
-        mock_get_file.return_value = xml
+        mock_get_file_chunks.return_value = iter([xml])
         result = bats_review.grep_failures("http://example.com/test.xml")
         assert result == {"suite1:failing_test"}
 
-    @patch("bats_review.get_file")
+    @patch("bats_review.get_file_chunks")
+    def test_grep_failures_split_chunks(self, mock_get_file_chunks):
+        # chunk boundaries may fall anywhere, even inside tags
+        cases = "".join(
+            f'<testcase classname="s" name="t{i}">'
+            + ("<failure>err</failure>" if i % 3 == 0 else "")
+            + "<system-out>output</system-out></testcase>"
+            for i in range(100)
+        )
+        xml = f"<testsuites><testsuite>{cases}</testsuite></testsuites>".encode()
+        mock_get_file_chunks.return_value = (
+            xml[i : i + 7] for i in range(0, len(xml), 7)
+        )
+        result = bats_review.grep_failures("http://example.com/test.xml")
+        assert result == {f"s:t{i}" for i in range(0, 100, 3)}
+
+    @patch("bats_review.get_file_chunks")
+    def test_grep_failures_nested_failure(self, mock_get_file_chunks):
+        # only a failure directly inside a testcase counts
+        xml = b"""
+        <testsuite>
+          <testcase classname="c" name="n"><system-out><failure/></system-out></testcase>
+        </testsuite>
+        """
+        mock_get_file_chunks.return_value = iter([xml])
+        assert bats_review.grep_failures("http://example.com/test.xml") == set()
+
+    @patch("bats_review.get_file_chunks")
     @patch("bats_review.log")
-    def test_grep_failures_malformed(self, mock_log, mock_get_file):
-        mock_get_file.return_value = "<this is not xml"
+    def test_grep_failures_malformed(self, mock_log, mock_get_file_chunks):
+        mock_get_file_chunks.return_value = iter([b"<this is not xml"])
         # script currently exits with code 1 on parse errors
         with pytest.raises(SystemExit) as exc:
             bats_review.grep_failures("http://example.com/test.xml")
         assert exc.value.code == 1
         mock_log.error.assert_called_once()
 
+    @patch("bats_review.get_file_chunks")
+    @patch("bats_review.log")
+    def test_grep_failures_truncated(self, mock_log, mock_get_file_chunks):
+        mock_get_file_chunks.return_value = iter([b"<testsuite><testcase"])
+        with pytest.raises(SystemExit) as exc:
+            bats_review.grep_failures("http://example.com/test.xml")
+        assert exc.value.code == 1
+        mock_log.error.assert_called_once()
+
 
 class TestProcessLogs:
     @patch("bats_review.grep_failures")
@@ -167,6 +306,47 @@ class TestResolveCloneChain:
         chain = bats_review.resolve_clone_chain("http://openqa", 123)
         assert chain == [123, 122, 121]
 
+    @patch("bats_review.get_job")
+    def test_resolve_clone_chain_on_job(self, mock_get_job):
+        jobs = {123: {"id": 123, "origin_id": 122}, 122: {"id": 122}}
+        mock_get_job.side_effect = lambda url: jobs[int(url.split("/")[-2])]
+        seen = []
+        chain = bats_review.resolve_clone_chain(
+            "http://openqa", 123, on_job=lambda job_id, job: seen.append(job_id)
+        )
+        assert chain == [123, 122]
+        assert seen == [123, 122]
+
+
+class TestGetLogs:
+    def job(self, test, distri, count):
+        return {
+            "settings": {"TEST": test, "DISTRI": distri},
+            "ulogs": [f"{i}.xml" for i in range(count)] + ["autoinst-log.txt"],
+        }
+
+    def test_get_logs_expected(self):
+        logs = bats_review.get_logs(
+            "http://openqa", 123, self.job("container_host_runc_testsuite", "sle", 2)
+        )
+        assert logs == [
+            "http://openqa/tests/123/file/0.xml",
+            "http://openqa/tests/123/file/1.xml",
+        ]
+
+    def test_get_logs_opensuse_not_cumulative(self):
+        job = self.job("podman_e2e", "opensuse", 4)
+        assert len(bats_review.get_logs("http://openqa", 123, job)) == 4
+        # The extra logs on Tumbleweed must not add up across jobs
+        assert len(bats_review.get_logs("http://openqa", 122, job)) == 4
+
+    @patch("bats_review.log")
+    def test_get_logs_no_logs(self, mock_log):
+        assert not bats_review.get_logs(
+            "http://openqa", 123, self.job("podman_e2e", "sle", 0)
+        )
+        mock_log.info.assert_called_once_with("Job %s has no logs, skipping", 123)
+
 
 class TestMain:
     def setup_method(self):
@@ -258,6 +438,50 @@ class TestMain:
         mock_log.info.assert_any_call("Job %s has only %d logs, skipping", 122, 2)
         mock_log.info.assert_any_call("No logs found in chain. Exiting")
 
+    @patch("bats_review.grep_failures")
+    @patch("bats_review.get_job")
+    @patch("bats_review.openqa_comment")
+    @patch("bats_review.log")
+    def test_main_prefetch(
+        self, mock_log, mock_openqa_comment, mock_get_job, mock_grep_failures
+    ):
+        """
+        Logs are fetched for every job as its details arrive while resolving the chain
+        """
+        jobs = {
+            123: {"id": 123, "origin_id": 122, "ulogs": ["a.xml", "b.xml"]},
+            122: {"id": 122, "origin_id": 121, "ulogs": ["a.xml", "b.xml"]},
+            121: {"id": 121, "ulogs": ["a.xml", "b.xml"]},
+        }
+        for job in jobs.values():
+            job["settings"] = {"TEST": "runc_testsuite", "DISTRI": "sle"}
+        mock_get_job.side_effect = lambda url: jobs[int(url.split("/")[-2])]
+        failures = {
+            "123/file/a.xml": {"x"},
+            "123/file/b.xml": {"y"},
+            "122/file/a.xml": {"x", "y"},
+            "122/file/b.xml": set(),
+            "121/file/a.xml": set(),
+            "121/file/b.xml": {"z"},
+        }
+        mock_grep_failures.side_effect = lambda url: failures[url.split("tests/")[1]]
+
+        bats_review.main("http://openqa.example.com/tests/123", dry_run=True)
+        assert sorted(c[0][0] for c in mock_grep_failures.call_args_list) == sorted(
+            f"http://openqa.example.com/tests/{k}" for k in failures
+        )
+        mock_openqa_comment.assert_called_once()
+
+    @patch("bats_review.grep_failures")
+    @patch("bats_review.get_job")
+    @patch("bats_review.log")
+    def test_main_prefetch_no_clones(self, mock_log, mock_get_job, mock_grep_failures):
+        mock_get_job.return_value = {"id": 123, "ulogs": ["a.xml"]}
+        with pytest.raises(SystemExit) as exc:
+            bats_review.main("http://openqa.example.com/tests/123", dry_run=True)
+        assert exc.value.code == 0
+        mock_grep_failures.assert_not_called()
+
 
 class TestParseArgs:
     @patch("sys.argv", ["script.py", "http://example.com/tests/123"])
@@ -270,6 +494,65 @@ class TestParseArgs:
         with pytest.raises(SystemExit):
             bats_review.parse_args()
 
+    @patch("sys.argv", ["script.py", "http://example.com/tests/123"])
+    @patch.dict(os.environ, {"XDG_CACHE_HOME": "/tmp/xdg"})
+    def test_parse_args_cache_dir(self):
+        args = bats_review.parse_args()
+        assert args.cache_dir == "/tmp/xdg/openqa-bats-review"
+        assert args.cache_max_age == bats_review.CACHE_MAX_AGE
+        assert not args.no_cache
+
+    @patch("sys.argv", ["script.py", "--batch", "-"])
+    def test_parse_args_batch(self):
+        args = bats_review.parse_args()
+        assert args.batch == "-"
+        assert args.url is None
+
+    @patch("sys.argv", ["script.py", "--batch", "-", "http://example.com/tests/123"])
+    def test_parse_args_batch_and_url(self):
+        with pytest.raises(SystemExit):
+            bats_review.parse_args()
+
+
+class TestBatch:
+    @patch("bats_review.main")
+    def test_review_exit_codes(self, mock_main):
+        mock_main.side_effect = [None, SystemExit(0), SystemExit(1), KeyError("x")]
+        codes = [bats_review.review(f"http://openqa/tests/{i}") for i in range(4)]
+        assert codes == [0, 0, 1, 1]
+
+    @patch("bats_review.main")
+    def test_batch(self, mock_main, capsys):
+        def fake_main(url, dry_run):
+            assert dry_run is True
+            if url.endswith("2"):
+                sys.exit(1)
+
+        mock_main.side_effect = fake_main
+        urls = [f"http://openqa/tests/{i}" for i in range(1, 4)]
+        assert bats_review.batch(urls, dry_run=True) == 1
+        assert capsys.readouterr().out.splitlines() == [
+            "http://openqa/tests/1 0",
+            "http://openqa/tests/2 1",
+            "http://openqa/tests/3 0",
+            "Reviewed 3 jobs: 2 succeeded, 1 failed",
+        ]
+
+    @patch("bats_review.main")
+    def test_batch_success(self, mock_main, capsys):
+        assert bats_review.batch(["http://openqa/tests/1"]) == 0
+        assert "1 succeeded, 0 failed" in capsys.readouterr().out
+
+    def test_read_urls(self, tmp_path):
+        path = tmp_path / "urls"
+        path.write_text(
+            "http://openqa/tests/1\n\n# comment\n  http://openqa/tests/2  \n"
+        )
+        assert bats_review.read_urls(str(path)) == [
+            "http://openqa/tests/1",
+            "http://openqa/tests/2",
+        ]
+
 
 #
 # Integration test
@@ -283,7 +566,7 @@ class TestIntegration:
         testcase, and assert that the script decides to tag as PASSED (dry_run).
         """
 
-        def fake_get(url, headers=None, timeout=None):
+        def fake_get(url, headers=None, timeout=None, stream=False):
             m = Mock()
             if "/api/v1/jobs/123/details" in url:
                 m.json.return_value = {
@@ -309,19 +592,23 @@ class TestIntegration:
                     }
                 }
             elif "/tests/123/file/test.xml" in url:
-                m.text = """
+                m.iter_content.return_value = [
+                    b"""
                     <testsuite>
                       <testcase classname="c" name="ok"/>
                       <testcase classname="c" name="failA"><failure>err</failure></testcase>
                     </testsuite>
                 """
+                ]
             elif "/tests/122/file/test.xml" in url:
-                m.text = """
+                m.iter_content.return_value = [
+                    b"""
                     <testsuite>
                       <testcase classname="c" name="ok"/>
                       <testcase classname="c" name="failB"><failure>err</failure></testcase>
                     </testsuite>
                 """
+                ]
             else:
                 # default (should not happen in this test)
                 m.json.return_value = {"job": {"id": 999, "ulogs": []}}
@@ -0,0 +1,338 @@
+"""
+tests for openqa-post-similarity
+"""
+
+import importlib.machinery
+import importlib.util
+import json
+import logging
+import os.path
+import re
+import shutil
+import sys
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+Levenshtein = pytest.importorskip("Levenshtein")
+pytest.importorskip("openqa_client")
+pytest.importorskip("pyecharts")
+pytest.importorskip("tqdm")
+
+rootpath = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+loader = importlib.machinery.SourceFileLoader(
+    "post_similarity", rootpath + "/openqa-post-similarity"
+)
+spec = importlib.util.spec_from_loader(loader.name, loader)
+similarity = importlib.util.module_from_spec(spec)
+# worker processes look up the functions they run by module name
+sys.modules[loader.name] = similarity
+loader.exec_module(similarity)
+
+MESSAGES = [
+    "Test died: no candidate needle with tag(s) 'desktop' matched",
+    "Test died: no candidate needle with tag(s) 'desktop' matched",
+    "Test died: no candidate needle with tag(s) 'login' matched",
+    "Test died: no candidate needle with tag(s) 'logout' matched",
+    "Test died: command 'zypper -n in vim' failed at lib/utils.pm line 10",
+    "Test died: command 'zypper -n in emacs' failed at lib/utils.pm line 10",
+    "Test died: command 'zypper -n in vim' failed at lib/utils.pm line 10",
+    "Test died: script timeout: systemctl restart sshd",
+    "Test died: script timeout: systemctl restart httpd",
+    "Test died: abc",
+    "Test died: abd",
+    "Test died: abe",
+    "Test died: no candidate needle with tag(s) 'desktop' matched",
+]
+
+
+@pytest.fixture
+def id_msg():
+    id_msg = {str(1000 + i): msg for i, msg in enumerate(MESSAGES)}
+    similarity.id_msg = id_msg
+    return id_msg
+
+
+def brute_force(id_msg, job_id, count):
+    # every job ordered by distance, jobs at the same distance in the order of id_msg
+    position = {other: index for index, other in enumerate(id_msg)}
+    ranked = sorted(
+        id_msg,
+        key=lambda other: (
+            Levenshtein.distance(id_msg[job_id], id_msg[other]),
+            position[other],
+        ),
+    )
+    return ranked[:count]
+
+
+def rank_all(id_msg, count, jobs):
+    msg_jobs = similarity.group_messages()
+    position = {job_id: index for index, job_id in enumerate(id_msg)}
+    similarity.shared = (similarity.BKTree(msg_jobs), msg_jobs, position, count)
+    messages = list(msg_jobs)
+    ranked = similarity.parallel_map(
+        similarity.rank_message, messages, jobs, disable=True
+    )
+    return dict(zip(messages, ranked))
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 5, len(MESSAGES), len(MESSAGES) + 1])
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_ranking_matches_brute_force(id_msg, count, jobs):
+    ranked = rank_all(id_msg, count, jobs)
+    for job_id, msg in id_msg.items():
+        ranked_jobs, radius = ranked[msg]
+        expected = brute_force(id_msg, job_id, count)
+        assert ranked_jobs == expected
+        if count > len(id_msg):
+            assert radius is None
+        else:
+            assert radius == Levenshtein.distance(msg, id_msg[expected[-1]])
+
+
+def test_ties_keep_job_order(id_msg):
+    ranked_jobs, radius = rank_all(id_msg, 3, 1)["Test died: abd"]
+    # abc and abe are both one edit away, abc comes first in id_msg
+    assert ranked_jobs == ["1010", "1009", "1011"]
+    assert radius == 1
+    ranked_jobs, radius = rank_all(id_msg, 2, 1)[MESSAGES[0]]
+    assert ranked_jobs == ["1000", "1001"]
+    assert radius == 0
+
+
+def test_bk_tree_search():
+    tree = similarity.BKTree(MESSAGES)
+    for query in set(MESSAGES) | {"Test died: abf", "something else"}:
+        for radius in (0, 1, 5, 20):
+            expected = sorted(
+                {
+                    (Levenshtein.distance(query, m), m)
+                    for m in MESSAGES
+                    if Levenshtein.distance(query, m) <= radius
+                }
+            )
+            assert sorted(tree.search(query, radius)) == expected
+            assert tree.within(query, radius) == bool(expected)
+
+
+def test_read_errors(tmp_path):
+    path = tmp_path / "autoinst-log.txt"
+    # only the last message is kept
+    path.write_bytes(
+        b"Test died: first\r\n[debug] retry\nTest died: last\r\n[debug] done\n"
+    )
+    assert similarity.read_errors(str(path)) == "Test died: last"
+    # without a trailing newline
+    path.write_bytes(b"[debug] start\nTest died: at the end")
+    assert similarity.read_errors(str(path)) == "Test died: at the end"
+    path.write_bytes(b"[debug] start\n[debug] done\n")
+    assert similarity.read_errors(str(path)) is None
+    # empty files can't be memory-mapped
+    path.write_bytes(b"")
+    assert similarity.read_errors(str(path)) is None
+    assert similarity.read_errors(str(tmp_path / "missing.txt")) is None
+
+
+def test_check_log(tmp_path):
+    path = tmp_path / "autoinst-log.txt"
+    path.write_text("Test died: foo\n")
+    os.utime(path, ns=(10**9, 10**9))
+    known = similarity.check_log(str(path), None)
+    assert known == (10**9, 15, "Test died: foo")
+    # unchanged logs are not read again
+    assert similarity.check_log(str(path), known) is None
+    path.write_text("Test died: bar\n")
+    assert similarity.check_log(str(path), known)[2] == "Test died: bar"
+    assert (
+        similarity.check_log(str(tmp_path / "missing.txt"), known) is similarity.MISSING
+    )
+
+
+def test_scan_logs(tmp_path):
+    known = {}
+    for job_id, content in (("1", "Test died: foo\n"), ("2", ""), ("3", "ok\n")):
+        os.makedirs(tmp_path / job_id)
+        path = tmp_path / job_id / "autoinst-log.txt"
+        path.write_text(content)
+        known[job_id] = (path.stat().st_mtime_ns, path.stat().st_size, None)
+    os.makedirs(tmp_path / "4")
+    del known["1"]
+    path = tmp_path / "3" / "autoinst-log.txt"
+    path.write_text("Test died: changed\n")
+    scanned, missing = similarity.scan_logs(
+        str(tmp_path) + "/", ["1", "2", "3", "4"], known, 2
+    )
+    # the unchanged log of job 2 is skipped, job 4 has no log
+    assert [(row[0], row[3]) for row in scanned] == [
+        ("1", "Test died: foo"),
+        ("3", "Test died: changed"),
+    ]
+    assert missing == ["4"]
+
+
+def write_log(testdir, job_id, msg, mtime):
+    os.makedirs(testdir / job_id, exist_ok=True)
+    path = testdir / job_id / "autoinst-log.txt"
+    path.write_text("[debug] starting\n" + msg + "\n[debug] done\n")
+    os.utime(path, ns=(mtime, mtime))
+
+
+def run(testdir, db, number=3):
+    logger = logging.getLogger("test")
+    similarity.result = {}
+    changes = similarity.read_id_msg(logger, str(testdir) + "/", 2, db)
+    similarity.cal_distance(logger, False, number, 1, db, changes)
+    return changes, similarity.result
+
+
+def test_incremental_updates(tmp_path):
+    testdir = tmp_path / "testresults"
+    db = similarity.open_cache(str(tmp_path / "cache.db"))
+    for i, msg in enumerate(MESSAGES):
+        write_log(testdir, str(1000 + i), msg, 10**9)
+
+    def check_round():
+        changes, result = run(testdir, db)
+        # the cached rankings must match ranking all jobs from scratch
+        id_msg = similarity.id_msg
+        assert result.keys() == id_msg.keys()
+        for job_id in id_msg:
+            expected = brute_force(id_msg, job_id, 4)
+            assert result[job_id] == [j for j in expected if j != job_id][:3]
+        return changes
+
+    stale_jobs, new_messages = check_round()
+    assert stale_jobs == set()
+    assert new_messages == set(MESSAGES)
+    # nothing changed, nothing is scanned again
+    assert check_round() == (set(), set())
+
+    # added job
+    write_log(testdir, "2000", "Test died: abf", 10**9)
+    assert check_round() == (set(), {"Test died: abf"})
+    assert "2000" in similarity.id_msg
+    # changed job
+    write_log(testdir, "1009", "Test died: zzz", 2 * 10**9)
+    assert check_round() == ({"1009"}, {"Test died: zzz"})
+    assert similarity.id_msg["1009"] == "Test died: zzz"
+    # removed job directory
+    shutil.rmtree(testdir / "1010")
+    assert check_round() == ({"1010"}, set())
+    assert "1010" not in similarity.id_msg
+    # removed log of a job whose directory is kept
+    os.remove(testdir / "1011" / "autoinst-log.txt")
+    assert check_round() == ({"1011"}, set())
+    assert "1011" not in similarity.id_msg
+    assert check_round() == (set(), set())
+
+
+def test_post_ledger(tmp_path):
+    db = similarity.open_cache(str(tmp_path / "cache.db"))
+    logger = logging.getLogger("test")
+    client = MagicMock()
+    client.openqa_request.side_effect = lambda method, path, data: {
+        "id": len(client.openqa_request.call_args_list)
+    }
+
+    def post(server="http://openqa"):
+        client.openqa_request.reset_mock()
+        with patch.object(similarity, "OpenQA_Client", return_value=client):
+            similarity.post(logger, server, 2, db, 1, 0)
+        return sorted(c[0][:2] for c in client.openqa_request.call_args_list)
+
+    similarity.result = {"1": ["2", "3"], "2": ["1", "3"]}
+    assert post() == [("POST", "jobs/1/comments"), ("POST", "jobs/2/comments")]
+    assert post() == []
+    # the comment with the changed ranking is updated
+    similarity.result["2"] = ["3", "1"]
+    ((method, path),) = post()
+    assert method == "PUT"
+    assert re.fullmatch(r"jobs/2/comments/[12]", path)
+    assert (
+        "[3](https://openqa.opensuse.org/tests/3)\r\n[1]"
+        in client.openqa_request.call_args[0][2]["text"]
+    )
+    assert post() == []
+    # jobs of another server with the same IDs are different jobs
+    assert post("http://other") == [
+        ("POST", "jobs/1/comments"),
+        ("POST", "jobs/2/comments"),
+    ]
+
+
+CLUSTER_MESSAGES = {
+    "1": "aaaa",
+    "2": "aaab",
+    "3": "zzzz",
+    "4": "aabb",
+    "5": "aaaa",
+    "6": "zzzy",
+    "7": "qqqqqqqq",
+}
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_cluster(tmp_path, jobs):
+    similarity.id_msg = dict(CLUSTER_MESSAGES)
+    path = tmp_path / "clusters.json"
+    clusters = similarity.cluster(logging.getLogger("test"), 1, jobs, str(path))
+    # aaaa and aabb are 2 apart but linked through aaab
+    assert clusters == [
+        {
+            "size": 4,
+            "representative": "aaaa",
+            "messages": ["aaaa", "aaab", "aabb"],
+            "jobs": ["1", "2", "4", "5"],
+        },
+        {
+            "size": 2,
+            "representative": "zzzz",
+            "messages": ["zzzz", "zzzy"],
+            "jobs": ["3", "6"],
+        },
+        {
+            "size": 1,
+            "representative": "qqqqqqqq",
+            "messages": ["qqqqqqqq"],
+            "jobs": ["7"],
+        },
+    ]
+    with open(path) as f:
+        assert json.load(f) == clusters
+    # with a threshold of 0 only identical messages are grouped
+    clusters = similarity.cluster(logging.getLogger("test"), 0, jobs, str(path))
+    assert [c["size"] for c in clusters] == [2, 1, 1, 1, 1, 1]
+
+
+def test_draw_clusters(tmp_path):
+    similarity.id_msg = dict(CLUSTER_MESSAGES)
+    logger = logging.getLogger("test")
+    clusters = similarity.cluster(logger, 1, 1, str(tmp_path / "clusters.json"))
+    with patch.object(similarity, "render") as render:
+        similarity.draw_clusters(logger, clusters, 4, "800x600", "chart.html")
+    nodes, links, resolution, save_path, categories = render.call_args[0]
+    assert save_path == "chart.html"
+    # the points are limited, every message is linked to its representative
+    assert len(nodes) == 4
+    assert len(categories) == 2
+    assert [(link.opts["source"], link.opts["target"]) for link in links] == [
+        ("aaab", "aaaa"),
+        ("aabb", "aaaa"),
+    ]
+    assert resolution == ["800", "600"]
+
+
+@pytest.mark.parametrize(
+    "geometry", ["1920", "1920x", "x1080", "1920x1080x2", "1920*1080", "-1x10", ""]
+)
+def test_parse_geometry_invalid(geometry):
+    assert similarity.parse_geometry(logging.getLogger("test"), geometry) is None
+
+
+def test_parse_geometry():
+    assert similarity.parse_geometry(logging.getLogger("test"), "1920x1080") == [
+        "1920",
+        "1080",
+    ]
@@ -0,0 +1,326 @@
+"""
+tests for openqa-powermanagement.py
+"""
+
+import importlib.machinery
+import importlib.util
+import os.path
+from argparse import Namespace
+from unittest.mock import MagicMock, patch
+from urllib.parse import urlparse
+
+import pytest
+
+rootpath = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+loader = importlib.machinery.SourceFileLoader(
+    "powermanagement", rootpath + "/openqa-powermanagement.py"
+)
+spec = importlib.util.spec_from_loader(loader.name, loader)
+powermanagement = importlib.util.module_from_spec(spec)
+loader.exec_module(powermanagement)
+
+
+def args_factory(**kwargs):
+    args = Namespace(
+        dry_run=True,
+        parallel=2,
+        daemon=False,
+        interval=0,
+        min_idle=0,
+        hold=0,
+        power_parallel=2,
+        power_timeout=10,
+        power_retries=0,
+        drain_time=0,
+        job_runtime=1800,
+    )
+    vars(args).update(kwargs)
+    return args
+
+
+def mocked_get(url, **kwargs):
+    # recorded API responses, the ids of the bulk jobs query are ignored
+    url = urlparse(url)
+    response = MagicMock(ok=True)
+    with open("tests/data/python-requests/" + url.netloc + url.path, "rb") as f:
+        response.content = f.read()
+    response.json.side_effect = lambda: powermanagement.json.loads(response.content)
+    return response
+
+
+@pytest.fixture
+def run(capsys):
+    def run(**kwargs):
+        powermanagement.args = args_factory(**kwargs)
+        powermanagement.openqa_server = "https://openqa.suse.de"
+        with patch.object(powermanagement.session, "get", side_effect=mocked_get):
+            powermanagement.main()
+        return capsys.readouterr().out
+
+    return run
+
+
+def fake_server(jobs, bulk=True, default=()):
+    # Answers job queries like openQA, optionally ignoring the ids parameter
+    def get(url, params=None, **kwargs):
+        path = urlparse(url).path
+        if path == "/api/v1/jobs":
+            ids = [int(i) for i in params["ids"].split(",")] if bulk else default
+            found = [jobs[i] for i in ids if i in jobs]
+            return MagicMock(ok=True, json=MagicMock(return_value={"jobs": found}))
+        job_id = int(path.split("/")[-1])
+        if job_id not in jobs:
+            return MagicMock(ok=False, status_code=404)
+        return MagicMock(ok=True, json=MagicMock(return_value={"job": jobs[job_id]}))
+
+    return get
+
+
+JOBS = {
+    i: {"id": i, "settings": {"WORKER_CLASS": worker_class}}
+    for i, worker_class in ((1, "x"), (2, "y"), (3, "x"), (4, "z"))
+}
+
+
+@pytest.mark.parametrize(
+    "bulk, default",
+    [
+        (True, ()),
+        # the server ignores the ids and returns a subset, a superset or nothing
+        (False, (1,)),
+        (False, (1, 2, 3, 4)),
+        (False, ()),
+    ],
+)
+def test_fetch_worker_classes(bulk, default):
+    server = fake_server(JOBS, bulk, default)
+    with patch.object(powermanagement.session, "get", side_effect=server) as get:
+        # job 5 was deleted meanwhile
+        classes = powermanagement.fetch_worker_classes([1, 2, 3, 5])
+    assert classes == powermanagement.Counter({"x": 2, "y": 1})
+    if bulk:
+        # only the missing job is looked up
+        assert get.call_count == 2
+
+
+def test_power_on_all_matching(run):
+    out = run()
+    assert "Found 4 different WORKER_CLASS in scheduled jobs" in out
+    assert "Would power ON 'worker1'" in out
+    assert "Would power ON 'worker2'" in out
+    assert "Would power ON 'worker3'" in out
+    assert "Removing 'worker6' from the list to power ON" in out
+    assert "Would power OFF 'worker4'" in out
+    assert "Would power OFF 'worker6'" in out
+
+
+def test_plan(run):
+    out = run(drain_time=3600)
+    # 10 jobs need 5 workers which worker1 and worker3 provide, they also
+    # cover the 6 jobs needing 3 workers together with the 2 busy ones
+    assert "Would power ON 'worker1'" in out
+    assert "Would power ON 'worker3'" in out
+    assert "Would power ON 'worker2'" not in out
+    assert "Missing 1 worker(s) to run 1 job(s) with WORKER_CLASS s390x-kvm" in out
+    # the recorded jobs are all scheduled, so --job-runtime is used
+    assert (
+        "No finished jobs with WORKER_CLASS qemu_x86_64, assuming a runtime of 1800 seconds"
+        in out
+    )
+    # the idle worker can run the aarch64 job
+    assert "Not powering OFF 'worker4' since it can run scheduled jobs" in out
+    assert "Would power OFF 'worker6'" in out
+
+
+def test_plan_longer_drain_time(run):
+    out = run(drain_time=2 * 3600)
+    # 10 jobs need 3 workers, 6 jobs need 2 which are online already
+    assert "Would power ON 'worker1'" in out
+    assert "Would power ON 'worker3'" not in out
+    assert "Would power ON 'worker2'" not in out
+
+
+def test_plan_power_on():
+    powermanagement.args = args_factory(drain_time=3600, job_runtime=3600)
+    workers = [
+        {"host": "a", "status": "dead", "properties": {"WORKER_CLASS": "x,y"}},
+        {"host": "b", "status": "dead", "properties": {"WORKER_CLASS": "x"}},
+        {"host": "b", "status": "dead", "properties": {"WORKER_CLASS": "x"}},
+        {"host": "c", "status": "idle", "properties": {"WORKER_CLASS": "x"}},
+    ]
+    jobs = powermanagement.Counter({"x": 3, "y,x": 1})
+    planned = powermanagement.plan_power_on(workers, jobs, {"a", "b"}, {"c"})
+    # b provides the most workers for x, y needs a
+    assert planned == {"a", "b"}
+    jobs = powermanagement.Counter({"x": 2})
+    planned = powermanagement.plan_power_on(workers, jobs, {"a", "b"}, {"c"})
+    assert planned == {"b"}
+    # jobs with x finish within 20 minutes, so c can run all of them
+    jobs = powermanagement.Counter({"x": 3, "y,x": 1})
+    runtimes = {"x": 1200}
+    planned = powermanagement.plan_power_on(workers, jobs, {"a", "b"}, {"c"}, runtimes)
+    assert planned == {"a"}
+
+
+def finished_job(job_id, worker_class, runtime, state="done"):
+    finished = None
+    if runtime is not None:
+        finished = f"2024-05-01T10:{runtime // 60:02}:{runtime % 60:02}"
+    return {
+        "id": job_id,
+        "state": state,
+        "t_started": "2024-05-01T10:00:00",
+        "t_finished": finished,
+        "settings": {"WORKER_CLASS": worker_class},
+    }
+
+
+def test_fetch_job_runtime():
+    powermanagement.args = args_factory()
+    jobs = [
+        finished_job(1, "x", 600),
+        finished_job(2, "x", 1200),
+        # the server may ignore the filters
+        finished_job(3, "y", 60),
+        finished_job(4, "x", None, state="running"),
+    ]
+    response = MagicMock(ok=True)
+    response.json.return_value = {"jobs": jobs}
+    with patch.object(powermanagement.session, "get", return_value=response) as get:
+        assert powermanagement.fetch_job_runtime("x") == 900
+        assert powermanagement.fetch_job_runtime("z") is None
+    assert get.call_args[1]["params"] == {
+        "state": "done",
+        "worker_class": "z",
+        "limit": powermanagement.RUNTIME_JOBS,
+    }
+
+
+def test_get_job_runtimes(capsys):
+    powermanagement.args = args_factory()
+    runtimes = {"x": 900.0, "y": None}
+    with patch.object(powermanagement, "fetch_job_runtime", side_effect=runtimes.get):
+        assert powermanagement.get_job_runtimes({"x": 1, "y": 2}) == {"x": 900}
+    out = capsys.readouterr().out
+    assert "Average runtime of jobs with WORKER_CLASS x: 900 seconds" in out
+    assert "No finished jobs with WORKER_CLASS y, assuming a runtime of 1800" in out
+
+
+def test_power_commands(capsys):
+    powermanagement.args = args_factory(dry_run=False, power_retries=1)
+    commands = {"a_POWER_ON": "true", "b_POWER_OFF": "false"}
+    state = powermanagement.PowerState()
+    with (
+        patch.dict(powermanagement.config, {"power_management": commands}),
+        patch.object(powermanagement, "RETRY_WAIT", 0),
+    ):
+        powermanagement.power([("a", "ON"), ("b", "OFF"), ("c", "ON")], state, 1)
+    assert "power_management" not in powermanagement.config
+    out = capsys.readouterr().out
+    assert "Powered ON 'a' in" in out
+    assert "Unable to power OFF 'b' after 2 attempt(s) in" in out
+    assert "exit code 1" in out
+    assert "Unable to power ON 'c' - No command for that" in out
+    assert state.last_action == {"a": 1}
+
+
+def test_power_command_timeout():
+    powermanagement.args = args_factory(power_retries=0, power_timeout=0.1)
+    assert powermanagement.run_power_command("sleep 5") == (
+        "timed out after 0.1 seconds",
+        1,
+    )
+    error, attempts = powermanagement.run_power_command("/nonexistent")
+    assert "No such file or directory" in error
+    assert attempts == 1
+
+
+def test_power_retries_not_negative():
+    with (
+        patch("sys.argv", ["script", "--power-retries", "-1"]),
+        pytest.raises(SystemExit),
+    ):
+        powermanagement.parse_args()
+    with patch("sys.argv", ["script", "--power-retries", "0"]):
+        assert powermanagement.parse_args().power_retries == 0
+
+
+def test_power_state_held():
+    powermanagement.args = args_factory(hold=600)
+    state = powermanagement.PowerState()
+    assert not state.held("a", 0)
+    state.last_action["a"] = 100
+    assert state.held("a", 699)
+    assert not state.held("a", 700)
+    assert not state.held("b", 699)
+
+
+def test_power_state_idle():
+    state = powermanagement.PowerState()
+    state.update_idle({"a", "b"}, 100)
+    state.update_idle({"b", "c"}, 200)
+    # machines keep the time they were first seen idle until they are busy
+    assert state.idle_since == {"b": 100, "c": 200}
+
+
+def test_min_idle_only_in_daemon_mode(run):
+    out = run(min_idle=600)
+    assert "Would power OFF 'worker4'" in out
+
+
+class StopDaemon(Exception):
+    pass
+
+
+def test_daemon(capsys):
+    powermanagement.args = args_factory(daemon=True, min_idle=600, hold=700)
+    powermanagement.openqa_server = "https://openqa.suse.de"
+    responses = [powermanagement.requests.exceptions.ConnectionError("refused")]
+
+    def get(url, **kwargs):
+        if responses:
+            raise responses.pop()
+        return mocked_get(url, **kwargs)
+
+    with (
+        patch.object(powermanagement.session, "get", side_effect=get),
+        patch("time.monotonic", side_effect=[0, 300, 900]),
+        patch("time.sleep", side_effect=[None, None, StopDaemon]) as sleep,
+        pytest.raises(StopDaemon),
+    ):
+        powermanagement.main()
+    assert sleep.call_count == 3
+    sleep.assert_called_with(0)
+    out = capsys.readouterr().out.split("Processing")
+    # the loop continues after errors
+    assert "Unable to check scheduled jobs and workers: refused" in out[0]
+    assert "Would power ON 'worker1'" in out[1]
+    assert "Not powering OFF 'worker4' since it is idle for only 0 seconds" in out[1]
+    # the broken machine is powered off right away
+    assert "Would power OFF 'worker6'" in out[1]
+    # worker1 and worker6 were powered at 300, worker4 is idle since then
+    assert "Not powering ON 'worker1' since it was powered on or off less" in out[2]
+    assert "Not powering OFF 'worker6' since it was powered on or off less" in out[2]
+    assert "Would power OFF 'worker4'" in out[2]
+
+
+def test_power_off_once(capsys):
+    powermanagement.args = args_factory()
+    workers = [
+        {"host": "a", "status": "idle", "properties": {"WORKER_CLASS": "x"}},
+        {"host": "a", "status": "broken", "properties": {"WORKER_CLASS": "x"}},
+    ]
+    responses = {
+        "/tests/list_scheduled_ajax": {"data": []},
+        "/api/v1/workers": {"workers": workers},
+    }
+
+    def get(url, **kwargs):
+        content = powermanagement.json.dumps(responses[urlparse(url).path])
+        return MagicMock(ok=True, content=content)
+
+    with patch.object(powermanagement.session, "get", side_effect=get):
+        powermanagement.check(powermanagement.PowerState())
+    # the machine is idle and broken but only powered off once
+    assert capsys.readouterr().out.count("Would power OFF 'a'") == 1
@@ -0,0 +1,115 @@
+"""
+tests for racktables/racktables.py
+"""
+
+import importlib.machinery
+import importlib.util
+import logging
+import os.path
+import re
+import time
+import tracemalloc
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+BeautifulSoup = pytest.importorskip("bs4").BeautifulSoup
+
+rootpath = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+loader = importlib.machinery.SourceFileLoader(
+    "racktables", rootpath + "/racktables/racktables.py"
+)
+spec = importlib.util.spec_from_loader(loader.name, loader)
+racktables = importlib.util.module_from_spec(spec)
+loader.exec_module(racktables)
+
+PAGES = ["object.html", "object_without_fqdn.html"]
+
+
+def read_page(name):
+    with open("tests/data/racktables/" + name) as page:
+        return page.read()
+
+
+def legacy_summary_rows(html):
+    # parsing the whole page as done before summary_rows()
+    soup = BeautifulSoup(html, "html.parser")
+    objectview_table = soup.find("table", {"class": "objectview"})
+    portlets = list(objectview_table.find_all("div", {"class": "portlet"}))
+    summary = next(filter(lambda x: x.find("h2").text == "summary", portlets))
+    rows = []
+    for row in summary.find_all("tr"):
+        try:
+            rows.append((row.find("th").text, row.find("td").text))
+        except AttributeError:
+            pass
+    return rows
+
+
+def racktables_mock(page):
+    rt = MagicMock(url="https://racktables.example.com")
+    rt.s.get.return_value = MagicMock(status_code=200, text=read_page(page))
+    return rt
+
+
+@pytest.mark.parametrize("fast", [True, False])
+def test_from_path(fast):
+    with patch.object(racktables, "lxml", racktables.lxml if fast else None):
+        if fast and racktables.lxml is None:
+            pytest.skip("lxml is not installed")
+        obj = racktables.RacktablesObject(racktables_mock("object.html"))
+        obj.from_path("index.php?page=object&object_id=1001")
+        assert obj.common_name == "machine1"
+        assert obj.fqdn == "machine1.qe.example.com"
+        assert obj.hw_type == "Dell PowerEdge R640"
+        obj = racktables.RacktablesObject(racktables_mock("object_without_fqdn.html"))
+        obj.from_path("index.php?page=object&object_id=1007")
+        assert obj.common_name == "machine7"
+        assert not hasattr(obj, "fqdn")
+
+
+def test_search():
+    rt = racktables.Racktables("https://racktables.example.com", "user", "pass")
+    rt.s = racktables_mock("search.html").s
+    results = rt.search({"page": "depot"})
+    assert len(results) == 120
+    assert results[1].find("a")["href"] == "index.php?page=object&object_id=1001"
+
+
+@pytest.mark.parametrize("page", PAGES)
+@pytest.mark.parametrize("fast", [True, False])
+def test_summary_rows(page, fast):
+    if fast and racktables.lxml is None:
+        pytest.skip("lxml is not installed")
+    html = read_page(page)
+    with patch.object(racktables, "lxml", racktables.lxml if fast else None):
+        rows = racktables.summary_rows(html)
+    assert rows == legacy_summary_rows(html)
+    assert re.match(r"machine\d+", dict(rows)["Common name:"])
+
+
+def measure(parse, html, repetitions=5):
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        parse(html)
+    duration = (time.perf_counter() - start) / repetitions
+    # only covers memory allocated by Python, not the tree built by lxml itself
+    tracemalloc.start()
+    parse(html)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return f"{duration * 1000:.2f}ms, {peak // 1024}kB peak"
+
+
+@pytest.mark.skipif("BENCHMARK" not in os.environ, reason="set BENCHMARK=1 to run")
+@pytest.mark.parametrize("page", PAGES)
+def test_summary_rows_benchmark(page):
+    # BENCHMARK=1 pytest -k benchmark --log-cli-level=INFO
+    html = read_page(page)
+    results = {"whole page": measure(legacy_summary_rows, html)}
+    with patch.object(racktables, "lxml", None):
+        results["strained"] = measure(racktables.summary_rows, html)
+    if racktables.lxml:
+        results["lxml"] = measure(racktables.summary_rows, html)
+    logging.getLogger(__name__).info(f"{page}: {results}")
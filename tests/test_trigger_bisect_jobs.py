@@ -3,17 +3,23 @@ tests for openqa-trigger-bisect-jobs
 """
 
 from argparse import Namespace
+import copy
+import hashlib
 import importlib.machinery
 import importlib.util
 import json
+import logging
 import os.path
 import re
+import time
 from unittest.mock import MagicMock, call, patch
 from urllib.parse import urlparse
 
 import pytest
 import requests
 
+RequestError = pytest.importorskip("openqa_client.exceptions").RequestError
+
 rootpath = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 
 loader = importlib.machinery.SourceFileLoader(
@@ -31,6 +37,9 @@ def args_factory():
     args.dry_run = False
     args.verbose = 1
     args.priority_add = 100
+    args.adaptive = False
+    args.poll_interval = 0
+    args.wait_timeout = 60
     return args
 
 
@@ -52,188 +61,238 @@ def mocked_fetch_url(url, request_type="text"):
     return content
 
 
-def mocked_call(cmds, dry_run=False):
-    return cmds
-
-
 orig_fetch_url = openqa.fetch_url
 
-cmds = [
-    "https://openqa.opensuse.org/tests/7848818",
-    "OS_TEST_ISSUES=21770,21926,21954,22030,22077,22085,22192",
-    "TEST=foo:investigate:bisect_without_21637",
-    "OPENQA_INVESTIGATE_ORIGIN=https://openqa.opensuse.org/tests/7848818",
-]
-
-
-def test_catch_CalledProcessError(caplog):
-    import subprocess
 
+def test_catch_RequestError(caplog):
     args = args_factory()
     args.url = "https://openqa.opensuse.org/tests/7848818"
     openqa.fetch_url = MagicMock(side_effect=mocked_fetch_url)
-    exp_err = "returned non-zero exit status 255."
-    error = subprocess.CompletedProcess(
-        args=[], returncode=255, stderr=exp_err, stdout=""
-    )
-    with patch("subprocess.run", return_value=error):
-        with pytest.raises(subprocess.CalledProcessError) as e:
-            openqa.main(args)
-
-    assert e.value.returncode == 255
-    assert f"{exp_err}" in str(e.value.stderr)
+    client = MagicMock()
+    error = RequestError("POST", "jobs", 500, "Internal Server Error")
+    client.openqa_request.side_effect = error
+    with (
+        patch.object(openqa, "openqa_client", return_value=client),
+        pytest.raises(RequestError) as e,
+    ):
+        openqa.main(args)
+    assert e.value.status_code == 500
 
     exp_err = "Current job 7848818 will fail, because the repositories for the below updates are unavailable"
-    error.stderr = exp_err
-    comment_process = subprocess.CompletedProcess(
-        args=[], returncode=0, stderr="", stdout=b"doo"
-    )
-    with patch("subprocess.run", side_effect=[error, comment_process]) as mocked:
-        with pytest.raises(SystemExit) as e:
-            openqa.main(args)
-        assert re.search(
-            "jobs/.*/comments.*text=.*updates are unavailable",
-            str(mocked.call_args_list[-1][0]),
-        )
+
+    def request(method, path, **kwargs):
+        # clones are submitted concurrently, only the comment succeeds
+        if path == "jobs":
+            raise RequestError("POST", path, 400, exp_err)
+        return {}
+
+    client.openqa_request.side_effect = request
+    with (
+        patch.object(openqa, "openqa_client", return_value=client),
+        pytest.raises(SystemExit) as e,
+    ):
+        openqa.main(args)
+    comments = [
+        c
+        for c in client.openqa_request.call_args_list
+        if c[0][1] == "jobs/7848818/comments"
+    ]
+    assert len(comments) == 1
+    assert "updates are unavailable" in comments[0][1]["data"]["text"]
     assert e.value.code == 0
-    assert f"{exp_err}" in caplog.text
+
+
+def test_client():
+    openqa.clients.clear()
+    client = openqa.openqa_client("https://openqa.opensuse.org")
+    assert client is openqa.openqa_client("https://openqa.opensuse.org")
+    assert client.baseurl == "https://openqa.opensuse.org"
+    assert client.session.headers["User-Agent"] == openqa.USER_AGENT
+    openqa.clients.clear()
 
 
 def test_clone():
-    openqa.call = MagicMock(side_effect=mocked_call)
-    openqa.openqa_clone(cmds, dry_run=False)
-    args = [
-        "openqa-clone-job",
-        "--skip-chained-deps",
-        "--json-output",
-        "--within-instance",
-        "https://openqa.opensuse.org/tests/7848818",
-        "OS_TEST_ISSUES=21770,21926,21954,22030,22077,22085,22192",
-        "TEST=foo:investigate:bisect_without_21637",
-        "OPENQA_INVESTIGATE_ORIGIN=https://openqa.opensuse.org/tests/7848818",
-        "_GROUP=0",
-    ]
-    openqa.call.assert_called_once_with(args, False)
+    client = MagicMock()
+    client.openqa_request.return_value = {"id": 234567}
+    job = {
+        "id": 7848818,
+        "settings": {
+            "NAME": "00000001-foo",
+            "TEST": "foo",
+            "OS_TEST_ISSUES": "21637,21770",
+            "MAINT_TEST_REPO": "http://example.com/repo",
+            "FLAVOR": "Server-DVD-Updates",
+        },
+    }
+    overrides = {
+        "OS_TEST_ISSUES": "21770",
+        "TEST": "foo:investigate:bisect_without_21637",
+        "MAINT_TEST_REPO": "",
+        "_PRIORITY": "150",
+    }
+    with patch.object(openqa, "openqa_client", return_value=client) as mocked:
+        out = openqa.openqa_clone("https://openqa.opensuse.org", job, overrides, False)
+    assert out == {"id": 234567}
+    mocked.assert_called_once_with("https://openqa.opensuse.org")
+    client.openqa_request.assert_called_once_with(
+        "POST",
+        "jobs",
+        data={
+            "TEST": "foo:investigate:bisect_without_21637",
+            "OS_TEST_ISSUES": "21770",
+            "FLAVOR": "Server-DVD-Updates",
+            "_PRIORITY": "150",
+            "CLONED_FROM": "https://openqa.opensuse.org/tests/7848818",
+            "is_clone_job": "1",
+            "_GROUP": "0",
+        },
+    )
+
+
+@pytest.mark.parametrize(
+    "settings, overrides, expected",
+    [
+        # NAME is generated by openQA for the new job
+        ({"NAME": "0001-foo", "TEST": "foo"}, {}, {"TEST": "foo"}),
+        # KEY=VALUE replaces or adds a setting
+        ({"TEST": "foo"}, {"TEST": "bar", "A": "1"}, {"TEST": "bar", "A": "1"}),
+        # KEY= removes a setting, also one that doesn't exist
+        ({"TEST": "foo", "A": "1"}, {"A": "", "B": ""}, {"TEST": "foo"}),
+        # empty settings of the original job are kept
+        ({"TEST": "foo", "A": ""}, {}, {"TEST": "foo", "A": ""}),
+        # the settings openqa-clone-job sets itself win over overrides
+        ({"TEST": "foo"}, {"_GROUP": "5", "is_clone_job": "0"}, {"TEST": "foo"}),
+    ],
+)
+def test_clone_like_openqa_clone_job(settings, overrides, expected):
+    # openqa-clone-job --skip-chained-deps --within-instance URL KEY=VALUE... _GROUP=0
+    client = MagicMock()
+    job = {"id": 1, "settings": dict(settings)}
+    with patch.object(openqa, "openqa_client", return_value=client):
+        openqa.openqa_clone("https://openqa.opensuse.org", job, overrides, False)
+    expected = dict(
+        expected,
+        CLONED_FROM="https://openqa.opensuse.org/tests/1",
+        is_clone_job="1",
+        _GROUP="0",
+    )
+    client.openqa_request.assert_called_once_with("POST", "jobs", data=expected)
+    # the job is reused for other clones
+    assert job["settings"] == settings
 
 
 def test_comment():
-    openqa.call = MagicMock(side_effect=mocked_call)
-    openqa.openqa_comment(
-        1234567, "https://openqa.opensuse.org", "foo\nbar", dry_run=False
+    client = MagicMock()
+    with patch.object(openqa, "openqa_client", return_value=client):
+        openqa.openqa_comment(
+            1234567, "https://openqa.opensuse.org", "foo\nbar", dry_run=False
+        )
+    client.openqa_request.assert_called_once_with(
+        "POST", "jobs/1234567/comments", data={"text": "foo\nbar"}
     )
-    args = [
-        "openqa-cli",
-        "api",
-        "--header",
-        "User-Agent: openqa-trigger-bisect-jobs (https://github.com/os-autoinst/scripts)",
-        "--host",
-        "https://openqa.opensuse.org",
-        "-X",
-        "POST",
-        "jobs/1234567/comments",
-        "text=foo\nbar",
-    ]
-    openqa.call.assert_called_once_with(args, False)
 
 
-def test_set_job_prio():
-    openqa.call = MagicMock(side_effect=mocked_call)
-    openqa.openqa_set_job_prio(
-        1234567, "https://openqa.opensuse.org", 42, dry_run=False
+def test_dry_run(caplog):
+    caplog.set_level(logging.INFO)
+    with patch.object(openqa, "openqa_client") as mocked:
+        out = openqa.openqa_comment(
+            1234567, "https://openqa.opensuse.org", "foo", dry_run=True
+        )
+    assert out == {}
+    mocked.assert_not_called()
+    assert (
+        "Simulating: POST https://openqa.opensuse.org/api/v1/jobs/1234567/comments"
+        in caplog.text
     )
-    args = [
-        "openqa-cli",
-        "api",
-        "--header",
-        "User-Agent: openqa-trigger-bisect-jobs (https://github.com/os-autoinst/scripts)",
-        "--host",
-        "https://openqa.opensuse.org",
-        "--json",
-        "--data",
-        '{"priority": 42}',
-        "-X",
-        "PUT",
-        "jobs/1234567",
-    ]
-    openqa.call.assert_called_once_with(args, False)
 
 
 def test_triggers():
     args = args_factory()
     args.url = "https://openqa.opensuse.org/tests/7848818"
-    openqa.openqa_clone = MagicMock(return_value='{"7848818": 234567}')
+    openqa.openqa_clone = MagicMock(return_value={"id": 234567})
     openqa.openqa_comment = MagicMock(return_value="")
-    openqa.openqa_set_job_prio = MagicMock(return_value="")
     openqa.fetch_url = MagicMock(side_effect=mocked_fetch_url)
     openqa.main(args)
+    job = mocked_fetch_url(
+        "https://openqa.opensuse.org/api/v1/jobs/7848818", request_type="json"
+    )["job"]
     calls = [
         call(
-            [
-                "https://openqa.opensuse.org/tests/7848818",
-                "CRAZY_TEST_ISSUES=1,4",
-                "COMMON_TEST_ISSUES=1,4,21637,21770,21926,21954,22030,22077,22085,22192",
-                "TEST=foo:investigate:bisect_without_3",
-                "OPENQA_INVESTIGATE_ORIGIN=https://openqa.opensuse.org/tests/7848818",
-                "MAINT_TEST_REPO=",
-            ],
+            "https://openqa.opensuse.org",
+            job,
+            {
+                "CRAZY_TEST_ISSUES": "1,4",
+                "COMMON_TEST_ISSUES": "1,4,21637,21770,21926,21954,22030,22077,22085,22192",
+                "TEST": "foo:investigate:bisect_without_3",
+                "OPENQA_INVESTIGATE_ORIGIN": "https://openqa.opensuse.org/tests/7848818",
+                "MAINT_TEST_REPO": "",
+                "_PRIORITY": "150",
+            },
             False,
         ),
         call(
-            [
-                "https://openqa.opensuse.org/tests/7848818",
-                "CRAZY_TEST_ISSUES=1,3",
-                "COMMON_TEST_ISSUES=1,3,21637,21770,21926,21954,22030,22077,22085,22192",
-                "TEST=foo:investigate:bisect_without_4",
-                "OPENQA_INVESTIGATE_ORIGIN=https://openqa.opensuse.org/tests/7848818",
-                "MAINT_TEST_REPO=",
-            ],
+            "https://openqa.opensuse.org",
+            job,
+            {
+                "CRAZY_TEST_ISSUES": "1,3",
+                "COMMON_TEST_ISSUES": "1,3,21637,21770,21926,21954,22030,22077,22085,22192",
+                "TEST": "foo:investigate:bisect_without_4",
+                "OPENQA_INVESTIGATE_ORIGIN": "https://openqa.opensuse.org/tests/7848818",
+                "MAINT_TEST_REPO": "",
+                "_PRIORITY": "150",
+            },
             False,
         ),
         call(
-            [
-                "https://openqa.opensuse.org/tests/7848818",
-                "OS_TEST_ISSUES=21770,21926,21954,22030,22077,22085,22192",
-                "COMMON_TEST_ISSUES=1,3,4,21770,21926,21954,22030,22077,22085,22192",
-                "TEST=foo:investigate:bisect_without_21637",
-                "OPENQA_INVESTIGATE_ORIGIN=https://openqa.opensuse.org/tests/7848818",
-                "MAINT_TEST_REPO=",
-            ],
+            "https://openqa.opensuse.org",
+            job,
+            {
+                "OS_TEST_ISSUES": "21770,21926,21954,22030,22077,22085,22192",
+                "COMMON_TEST_ISSUES": "1,3,4,21770,21926,21954,22030,22077,22085,22192",
+                "TEST": "foo:investigate:bisect_without_21637",
+                "OPENQA_INVESTIGATE_ORIGIN": "https://openqa.opensuse.org/tests/7848818",
+                "MAINT_TEST_REPO": "",
+                "_PRIORITY": "150",
+            },
             False,
         ),
         call(
-            [
-                "https://openqa.opensuse.org/tests/7848818",
-                "OS_TEST_ISSUES=21637,21770,21926,21954,22030,22077,22192",
-                "COMMON_TEST_ISSUES=1,3,4,21637,21770,21926,21954,22030,22077,22192",
-                "TEST=foo:investigate:bisect_without_22085",
-                "OPENQA_INVESTIGATE_ORIGIN=https://openqa.opensuse.org/tests/7848818",
-                "MAINT_TEST_REPO=",
-            ],
+            "https://openqa.opensuse.org",
+            job,
+            {
+                "OS_TEST_ISSUES": "21637,21770,21926,21954,22030,22077,22192",
+                "COMMON_TEST_ISSUES": "1,3,4,21637,21770,21926,21954,22030,22077,22192",
+                "TEST": "foo:investigate:bisect_without_22085",
+                "OPENQA_INVESTIGATE_ORIGIN": "https://openqa.opensuse.org/tests/7848818",
+                "MAINT_TEST_REPO": "",
+                "_PRIORITY": "150",
+            },
             False,
         ),
         call(
-            [
-                "https://openqa.opensuse.org/tests/7848818",
-                "OS_TEST_ISSUES=21637,21770,21926,21954,22030,22077,22085",
-                "COMMON_TEST_ISSUES=1,3,4,21637,21770,21926,21954,22030,22077,22085",
-                "TEST=foo:investigate:bisect_without_22192",
-                "OPENQA_INVESTIGATE_ORIGIN=https://openqa.opensuse.org/tests/7848818",
-                "MAINT_TEST_REPO=",
-            ],
+            "https://openqa.opensuse.org",
+            job,
+            {
+                "OS_TEST_ISSUES": "21637,21770,21926,21954,22030,22077,22085",
+                "COMMON_TEST_ISSUES": "1,3,4,21637,21770,21926,21954,22030,22077,22085",
+                "TEST": "foo:investigate:bisect_without_22192",
+                "OPENQA_INVESTIGATE_ORIGIN": "https://openqa.opensuse.org/tests/7848818",
+                "MAINT_TEST_REPO": "",
+                "_PRIORITY": "150",
+            },
             False,
         ),
     ]
-    assert sorted(calls) == sorted(openqa.openqa_clone.call_args_list)
+    # clones are submitted concurrently
+    assert len(calls) == len(openqa.openqa_clone.call_args_list)
+    for c in calls:
+        assert c in openqa.openqa_clone.call_args_list
     openqa.openqa_comment.assert_called_once_with(
         7848818,
         "https://openqa.opensuse.org",
         "Automatic bisect jobs:\n\n* **foo:investigate:bisect_without_3**: https://openqa.opensuse.org/t234567\n* **foo:investigate:bisect_without_4**: https://openqa.opensuse.org/t234567\n* **foo:investigate:bisect_without_21637**: https://openqa.opensuse.org/t234567\n* **foo:investigate:bisect_without_22085**: https://openqa.opensuse.org/t234567\n* **foo:investigate:bisect_without_22192**: https://openqa.opensuse.org/t234567\n",
         False,
     )
-    prio_calls = 5 * [
-        call(234567, "https://openqa.opensuse.org/tests/7848818", 150, False)
-    ]
-    assert prio_calls == openqa.openqa_set_job_prio.call_args_list
 
 
 def test_problems():
@@ -373,3 +432,410 @@ def test_issue_types():
         }
     }
     assert changes_repos == exp_repos
+
+
+def test_batch_claim():
+    batch = openqa.Batch()
+    changes = openqa.find_changed_issues(
+        '- "OS_TEST_ISSUES": "1,2",\n+ "OS_TEST_ISSUES": "1,2,3",'
+    )
+    same = openqa.find_changed_issues(
+        '- "OS_TEST_ISSUES": "2,1",\n+ "OS_TEST_ISSUES": "3,2,1",'
+    )
+    other = openqa.find_changed_issues(
+        '- "OS_TEST_ISSUES": "1,2",\n+ "OS_TEST_ISSUES": "1,2,4",'
+    )
+    job = {"settings": {"TEST": "foo", "ARCH": "x86_64", "MACHINE": "64bit"}}
+    other_arch = {"settings": dict(job["settings"], ARCH="aarch64")}
+    key = openqa.Batch.key(changes, job)
+    assert batch.claim(key, "http://openqa/tests/1") is None
+    assert batch.claim(openqa.Batch.key(same, job), "http://openqa/tests/2") == (
+        "http://openqa/tests/1",
+        False,
+    )
+    assert batch.claim(openqa.Batch.key(other, job), "http://openqa/tests/3") is None
+    assert batch.claim(openqa.Batch.key(changes, other_arch), "http://o/t/4") is None
+    assert batch.skipped == 1
+    # jobs skipped while bisecting are handed out once it succeeded
+    assert batch.finish(key, True) == ["http://openqa/tests/2"]
+    assert batch.claim(key, "http://openqa/tests/5") == ("http://openqa/tests/1", True)
+    assert batch.skipped == 2
+
+
+def test_batch_claim_failed():
+    batch = openqa.Batch()
+    changes = openqa.find_changed_issues(
+        '- "OS_TEST_ISSUES": "1,2",\n+ "OS_TEST_ISSUES": "1,2,3",'
+    )
+    key = openqa.Batch.key(changes, {"settings": {"TEST": "foo"}})
+    assert batch.claim(key, "http://openqa/tests/1") is None
+    assert batch.claim(key, "http://openqa/tests/2") is not None
+    # the skipped job is handled again and can claim the changes itself
+    assert batch.finish(key, False) == []
+    assert batch.retry == ["http://openqa/tests/2"]
+    assert batch.skipped == 0
+    assert batch.claim(key, "http://openqa/tests/2") is None
+
+
+def test_batch(capsys):
+    args = args_factory()
+    args.batch = "-"
+    openqa.openqa_clone = MagicMock(return_value={"id": 234567})
+    openqa.openqa_comment = MagicMock(return_value="")
+    openqa.fetch_url = MagicMock(side_effect=mocked_fetch_url)
+    urls = [
+        "https://openqa.opensuse.org/tests/7848818",
+        # the same incident changes, no further bisection jobs
+        "https://openqa.opensuse.org/tests/7848818",
+        # nothing to bisect
+        "http://openqa.opensuse.org/tests/1234",
+        # broken investigation data
+        "http://openqa.opensuse.org/tests/123",
+    ]
+    assert openqa.run_batch(args, urls) == 1
+    assert openqa.openqa_clone.call_count == 5
+    # the skipped job links to the bisection covering it
+    assert openqa.openqa_comment.call_count == 2
+    comment = [c for c in openqa.openqa_comment.call_args_list if "Not" in c[0][2]]
+    assert comment[0][0][:2] == ("7848818", "https://openqa.opensuse.org")
+    assert "https://openqa.opensuse.org/tests/7848818" in comment[0][0][2]
+    assert (
+        capsys.readouterr().out
+        == "Handled 4 jobs: created 5 bisection jobs, skipped 1 jobs with already bisected incident changes, 1 failed\n"
+    )
+
+
+@pytest.mark.parametrize("created", [{"id": 234567}, {}])
+def test_batch_skipped_while_cloning(created):
+    batch = openqa.Batch()
+    args = args_factory()
+    args.url = "https://openqa.opensuse.org/tests/7848818"
+    skipped = copy.copy(args)
+    skipped.url = "https://openqa.opensuse.org/tests/7848819"
+
+    def clone(host, job, overrides, dry_run):
+        # the job with the same changes shows up while cloning
+        if openqa.openqa_clone.call_count == 1:
+            assert openqa.main(skipped, batch) == 0
+        return created
+
+    openqa.openqa_clone = MagicMock(side_effect=clone)
+    openqa.openqa_comment = MagicMock(return_value="")
+    openqa.fetch_url = MagicMock(
+        side_effect=lambda url, **kwargs: mocked_fetch_url(
+            url.replace("7848819", "7848818"), **kwargs
+        )
+    )
+    openqa.main(args, batch)
+    comments = [c[0][:2] for c in openqa.openqa_comment.call_args_list]
+    if created:
+        # the skipped job links to the bisection covering it
+        assert ("7848819", "https://openqa.opensuse.org") in comments
+        assert batch.skipped == 1
+        assert not batch.retry
+    else:
+        # the skipped job is bisected on its own
+        assert comments == []
+        assert batch.skipped == 0
+        assert batch.retry == [skipped.url]
+
+
+def test_batch_retry(capsys):
+    handled = []
+
+    def main(args, batch):
+        handled.append(args.url)
+        if len(handled) == 1:
+            batch.retry.append("http://openqa/tests/2")
+        return 1
+
+    with patch.object(openqa, "main", side_effect=main):
+        assert openqa.run_batch(args_factory(), ["http://openqa/tests/1"]) == 0
+    assert handled == ["http://openqa/tests/1", "http://openqa/tests/2"]
+    assert "created 2 bisection jobs" in capsys.readouterr().out
+
+
+def test_read_urls(tmp_path):
+    path = tmp_path / "urls"
+    path.write_text(
+        "https://openqa.opensuse.org/tests/1\n\n# comment\nhttps://openqa.opensuse.org/tests/2\nhttps://openqa.opensuse.org/tests/1\n"
+    )
+    assert openqa.read_urls(str(path)) == [
+        "https://openqa.opensuse.org/tests/1",
+        "https://openqa.opensuse.org/tests/2",
+    ]
+
+
+def test_parse_args_batch():
+    with patch("sys.argv", ["script", "--batch", "-"]):
+        args = openqa.parse_args()
+    assert args.batch == "-"
+    with patch("sys.argv", ["script"]), pytest.raises(SystemExit):
+        openqa.parse_args()
+
+
+real_clone = openqa.openqa_clone
+
+
+def adaptive_mocks(culprit, results=None):
+    jobs = {}
+
+    def clone(host, job, overrides, dry_run):
+        job_id = 300000 + len(jobs)
+        excluded = overrides["TEST"].split("bisect_without_")[1].split("_")
+        jobs[job_id] = "passed" if culprit in excluded else "failed"
+        return {"id": job_id}
+
+    def request(host, method, path, dry_run, **kwargs):
+        job_id = int(path.split("/")[1])
+        if results and job_id in results:
+            return {"job": results[job_id]}
+        return {"job": {"id": job_id, "state": "done", "result": jobs[job_id]}}
+
+    openqa.openqa_clone = MagicMock(side_effect=clone)
+    openqa.openqa_comment = MagicMock(return_value="")
+    openqa.fetch_url = MagicMock(side_effect=mocked_fetch_url)
+    return request
+
+
+def test_adaptive():
+    args = args_factory()
+    args.adaptive = True
+    args.url = "https://openqa.opensuse.org/tests/7848818"
+    # issues 3, 4, 21637, 22085, 22192
+    with patch.object(openqa, "openqa_request", side_effect=adaptive_mocks("22085")):
+        assert openqa.main(args) == 3
+    tests = [c[0][2]["TEST"] for c in openqa.openqa_clone.call_args_list]
+    assert tests == [
+        "foo:investigate:bisect_without_3_4",
+        "foo:investigate:bisect_without_21637",
+        "foo:investigate:bisect_without_22085",
+    ]
+    overrides = openqa.openqa_clone.call_args_list[0][0][2]
+    assert overrides["CRAZY_TEST_ISSUES"] == "1"
+    assert (
+        overrides["COMMON_TEST_ISSUES"]
+        == "1,21637,21770,21926,21954,22030,22077,22085,22192"
+    )
+    assert overrides["_PRIORITY"] == "150"
+    openqa.openqa_comment.assert_called_once_with(
+        7848818,
+        "https://openqa.opensuse.org",
+        "Automatic bisect jobs:\n\n* **foo:investigate:bisect_without_3_4**: https://openqa.opensuse.org/t300000 (failed)\n* **foo:investigate:bisect_without_21637**: https://openqa.opensuse.org/t300001 (failed)\n* **foo:investigate:bisect_without_22085**: https://openqa.opensuse.org/t300002 (passed)\n\nThe failure is most likely caused by issue 22085\n",
+        False,
+    )
+
+
+def test_adaptive_first_half():
+    args = args_factory()
+    args.adaptive = True
+    args.url = "https://openqa.opensuse.org/tests/7848818"
+    with patch.object(openqa, "openqa_request", side_effect=adaptive_mocks("4")):
+        assert openqa.main(args) == 2
+    tests = [c[0][2]["TEST"] for c in openqa.openqa_clone.call_args_list]
+    assert tests == [
+        "foo:investigate:bisect_without_3_4",
+        "foo:investigate:bisect_without_3",
+    ]
+    assert "caused by issue 4\n" in openqa.openqa_comment.call_args[0][2]
+
+
+def test_adaptive_inconclusive():
+    args = args_factory()
+    args.adaptive = True
+    args.url = "https://openqa.opensuse.org/tests/7848818"
+    results = {
+        # restarted by openQA, the clone is still running at first
+        300000: {"id": 300000, "state": "done", "result": "incomplete", "clone_id": 7},
+        7: {"id": 7, "state": "running", "result": "none"},
+    }
+    request = adaptive_mocks("4", results)
+
+    def poll(host, method, path, dry_run, **kwargs):
+        job = request(host, method, path, dry_run, **kwargs)
+        if path == "jobs/7":
+            results[7] = {"id": 7, "state": "done", "result": "parallel_failed"}
+        return job
+
+    with (
+        patch.object(openqa, "openqa_request", side_effect=poll) as mocked,
+        patch("time.sleep") as sleep,
+    ):
+        assert openqa.main(args) == 1
+    assert [c[0][2] for c in mocked.call_args_list] == [
+        "jobs/300000",
+        "jobs/7",
+        "jobs/7",
+    ]
+    sleep.assert_called_once_with(0)
+    assert openqa.openqa_comment.call_args[0][2].endswith(
+        "https://openqa.opensuse.org/t7 (parallel_failed)\n\nThe bisection was inconclusive\n"
+    )
+
+
+def test_adaptive_dry_run():
+    args = args_factory()
+    args.adaptive = True
+    args.dry_run = True
+    args.url = "https://openqa.opensuse.org/tests/7848818"
+    openqa.fetch_url = MagicMock(side_effect=mocked_fetch_url)
+    openqa.openqa_comment = MagicMock(return_value="")
+    with (
+        patch.object(openqa, "openqa_client") as mocked,
+        patch.object(openqa, "openqa_clone", real_clone),
+    ):
+        assert openqa.main(args) == 0
+    mocked.assert_not_called()
+    openqa.openqa_comment.assert_not_called()
+
+
+@pytest.mark.parametrize("culprit", ["22192", None])
+def test_adaptive_last_candidate(culprit):
+    args = args_factory()
+    args.adaptive = True
+    args.url = "https://openqa.opensuse.org/tests/7848818"
+    with patch.object(openqa, "openqa_request", side_effect=adaptive_mocks(culprit)):
+        assert openqa.main(args) == 4
+    tests = [c[0][2]["TEST"] for c in openqa.openqa_clone.call_args_list]
+    # the last candidate was never left out, so a job without it is needed
+    assert tests[-1] == "foo:investigate:bisect_without_22192"
+    comment = openqa.openqa_comment.call_args[0][2]
+    if culprit:
+        assert comment.endswith("caused by issue 22192\n")
+    else:
+        # none of the issues causes the failure
+        assert comment.endswith("(failed)\n\nThe bisection was inconclusive\n")
+
+
+def test_adaptive_timeout():
+    args = args_factory()
+    args.adaptive = True
+    args.url = "https://openqa.opensuse.org/tests/7848818"
+    results = {300000: {"id": 300000, "state": "scheduled", "result": "none"}}
+    request = adaptive_mocks("4", results)
+    with (
+        patch.object(openqa, "openqa_request", side_effect=request) as mocked,
+        patch("time.sleep") as sleep,
+        patch("time.monotonic", side_effect=[0, 30, 60]),
+    ):
+        assert openqa.main(args) == 1
+    assert mocked.call_count == 2
+    sleep.assert_called_once_with(0)
+    assert openqa.openqa_comment.call_args[0][2].endswith(
+        "https://openqa.opensuse.org/t300000 (not finished)\n\nThe bisection was inconclusive\n"
+    )
+
+
+def test_adaptive_error():
+    args = args_factory()
+    args.adaptive = True
+    args.url = "https://openqa.opensuse.org/tests/7848818"
+    request = adaptive_mocks("22085")
+    clone = openqa.openqa_clone.side_effect
+
+    def failing_clone(host, job, overrides, dry_run):
+        if openqa.openqa_clone.call_count > 1:
+            raise RequestError("POST", "jobs", 500, "Internal Server Error")
+        return clone(host, job, overrides, dry_run)
+
+    openqa.openqa_clone.side_effect = failing_clone
+    with (
+        patch.object(openqa, "openqa_request", side_effect=request),
+        pytest.raises(RequestError),
+    ):
+        openqa.main(args)
+    # the job created before the error is commented
+    openqa.openqa_comment.assert_called_once()
+    comment = openqa.openqa_comment.call_args[0][2]
+    assert "https://openqa.opensuse.org/t300000 (failed)" in comment
+    assert comment.endswith("The bisection was inconclusive\n")
+
+
+class LegacyIncident:
+    """Incident as implemented before parsing the ID and hash up front."""
+
+    def __init__(self, inc):
+        self.incident = inc
+
+    @property
+    def incident_id(self):
+        try:
+            return self.incident.split("/")[6]
+        except IndexError:
+            return self.incident
+
+    def __eq__(self, other):
+        return self.incident_id == other.incident_id
+
+    def __lt__(self, other):
+        return int(self.incident_id) < int(other.incident_id)
+
+    def __hash__(self):
+        return int(hashlib.md5(self.incident.encode()).hexdigest(), base=16)
+
+
+def legacy_find_changed_issues(investigation):
+    changes = {}
+    pattern = re.compile(
+        r"(?P<diff>[+-])\s+\"(?P<key>[A-Z]+_TEST_(?:ISSUES|REPOS))\"\s*:\s*\"(?P<var>[^\"]*)\","
+    )
+    for line in investigation.splitlines():
+        search = pattern.match(line)
+        if search:
+            changes.setdefault(search.group("key"), {})[search.group("diff")] = {
+                LegacyIncident(i) for i in search.group("var").split(",")
+            }
+    return changes
+
+
+def large_investigation(incidents=800, settings=20000):
+    repo = "http://download.suse.de/ibs/SUSE:/Maintenance:/{}/SUSE_Updates_"
+    lines = [f' "SETTING_{i}": "{i}",' for i in range(settings)]
+    for key, fmt in (
+        ("BASE", "{}"),
+        ("SDK", repo + "SDK/"),
+        ("OS", repo + "OS/"),
+    ):
+        good = [fmt.format(i) for i in range(10000, 10000 + incidents)]
+        added = range(20000, 20000 + incidents // 10)
+        bad = good[incidents // 10 :] + [fmt.format(i) for i in added]
+        lines.insert(settings // 2, f'- "{key}_TEST_ISSUES": "{",".join(good)}",')
+        lines.insert(settings // 2, f'+ "{key}_TEST_ISSUES": "{",".join(bad)}",')
+    return "\n".join(lines)
+
+
+def bisect_steps(changes, sort_key=None):
+    # the set differences and sorts done by main() and bisect_overrides()
+    good, bad = openqa.GOOD, openqa.BAD
+    added = [i for c in changes.values() for i in c[bad] - c[good]]
+    issues = sorted({i.incident_id for i in added}, key=int)
+    ordered = {
+        key: [str(i.incident) for i in sorted(c[bad], key=sort_key)]
+        for key, c in changes.items()
+    }
+    return issues, ordered
+
+
+def test_find_changed_issues_large():
+    investigation = large_investigation()
+    legacy = bisect_steps(legacy_find_changed_issues(investigation))
+    current = bisect_steps(openqa.find_changed_issues(investigation), Incident.sort_key)
+    assert current == legacy
+
+
+@pytest.mark.skipif("BENCHMARK" not in os.environ, reason="set BENCHMARK=1 to run")
+def test_find_changed_issues_benchmark():
+    # BENCHMARK=1 pytest -k benchmark --log-cli-level=INFO
+    investigation = large_investigation()
+
+    def run(find, sort_key=None):
+        start = time.perf_counter()
+        for _ in range(3):
+            bisect_steps(find(investigation), sort_key)
+        return time.perf_counter() - start
+
+    legacy_time = run(legacy_find_changed_issues)
+    current_time = run(openqa.find_changed_issues, Incident.sort_key)
+    logging.getLogger(__name__).info(
+        f"legacy: {legacy_time:.3f}s, current: {current_time:.3f}s"
+    )